@@ -28,6 +28,8 @@ import rlcompleter
 import line as lineparts
 import re
 import os
+import weakref
+from functools import partial
 from glob import glob
 from bpython import inspection
 from bpython import importcompletion
@@ -75,14 +77,14 @@ def get_completer(cursor_offset, current_line, locals_, argspec, full_code, mode
     for completer in [DictKeyCompletion]:
         matches = completer.matches(cursor_offset, current_line, **kwargs)
         if matches:
-            return sorted(set(matches)), completer
+            return sort_matches(matches, completer, mode), completer
 
     # mutually exclusive matchers: if one returns [], don't go on
     for completer in [StringLiteralAttrCompletion, ImportCompletion,
             FilenameCompletion, MagicMethodCompletion, GlobalCompletion]:
         matches = completer.matches(cursor_offset, current_line, **kwargs)
         if matches is not None:
-            return sorted(set(matches)), completer
+            return sort_matches(matches, completer, mode), completer
 
     matches = AttrCompletion.matches(cursor_offset, current_line, **kwargs)
 
@@ -96,10 +98,24 @@ def get_completer(cursor_offset, current_line, locals_, argspec, full_code, mode
 
     if len(current_word_matches) == 0:
         return None, None
-    return sorted(set(current_word_matches)), AttrCompletion
+    return sort_matches(current_word_matches, AttrCompletion, mode), AttrCompletion
+
+def sort_matches(matches, completer, mode):
+    """Remove duplicate matches and sort them alphabetically, unless the
+    completer already ranked them for a non-simple autocomplete mode"""
+    if mode == SIMPLE or not completer.ranked:
+        return sorted(set(matches))
+    seen = set()
+    unique = []
+    for match in matches:
+        if match not in seen:
+            seen.add(match)
+            unique.append(match)
+    return unique
 
 class BaseCompletionType(object):
     """Describes different completion types"""
+    ranked = False # matches are ranked by a Matcher in non-simple modes
     def matches(cls, cursor_offset, line, **kwargs):
         """Returns a list of possible matches given a line and cursor, or None
         if this completion type isn't applicable.
@@ -131,9 +147,11 @@ class BaseCompletionType(object):
         return result
 
 class ImportCompletion(BaseCompletionType):
+    ranked = True
     @classmethod
-    def matches(cls, cursor_offset, current_line, **kwargs):
-        return importcompletion.complete(cursor_offset, current_line)
+    def matches(cls, cursor_offset, current_line, mode=SIMPLE, **kwargs):
+        matcher = None if mode == SIMPLE else partial(Matcher, mode=mode)
+        return importcompletion.complete(cursor_offset, current_line, matcher)
     locate = staticmethod(lineparts.current_word)
     format = staticmethod(after_last_dot)
 
@@ -166,6 +184,7 @@ class FilenameCompletion(BaseCompletionType):
             return filename
 
 class AttrCompletion(BaseCompletionType):
+    ranked = True
     @classmethod
     def matches(cls, cursor_offset, line, locals_, mode, **kwargs):
         r = cls.locate(cursor_offset, line)
@@ -269,6 +288,7 @@ class MagicMethodCompletion(BaseCompletionType):
         return [name for name in MAGIC_METHODS if name.startswith(word)]
 
 class GlobalCompletion(BaseCompletionType):
+    ranked = True
     @classmethod
     def matches(cls, cursor_offset, line, locals_, mode, **kwargs):
         """Compute matches when text is a simple name.
@@ -280,19 +300,19 @@ class GlobalCompletion(BaseCompletionType):
             return None
         start, end, text = r
 
+        matcher = Matcher(text, mode)
         hash = {}
-        n = len(text)
         import keyword
         for word in keyword.kwlist:
-            if method_match(word, n, text, mode):
-                hash[word] = 1
+            if matcher.match(word):
+                hash[word] = word
         for nspace in [__builtin__.__dict__, locals_]:
             for word, val in nspace.items():
-                if method_match(word, len(text), text, mode) and word != "__builtins__":
-                    hash[_callable_postfix(val, word)] = 1
-        matches = hash.keys()
-        matches.sort()
-        return matches
+                if matcher.match(word) and word != "__builtins__":
+                    hash[word] = val
+        return [word if keyword.iskeyword(word) else
+                _callable_postfix(hash[word], word)
+                for word in matcher.rank(hash)]
 
     locate = staticmethod(lineparts.current_single_word)
 
@@ -361,14 +381,12 @@ def attr_matches(text, namespace, autocomplete_mode):
     obj = safe_eval(expr, namespace)
     if obj is SafeEvalFailed:
         return []
-    with inspection.AttrCleaner(obj):
-        matches = attr_lookup(obj, expr, attr, autocomplete_mode)
-    return matches
+    return attr_lookup(obj, expr, attr, autocomplete_mode)
 
-def attr_lookup(obj, expr, attr, autocomplete_mode):
-    """Second half of original attr_matches method factored out so it can
-    be wrapped in a safe try/finally block in case anything bad happens to
-    restore the original __getattribute__ method."""
+def attr_names(obj):
+    """Return all attribute names of obj. Should be wrapped in an
+    inspection.AttrCleaner to restore the original __getattribute__ method in
+    case anything bad happens."""
     words = dir(obj)
     if hasattr(obj, '__class__'):
         words.append('__class__')
@@ -378,13 +396,62 @@ def attr_lookup(obj, expr, attr, autocomplete_mode):
                 words.remove('__abstractmethods__')
             except ValueError:
                 pass
+    return words
+
+class AttrCache(object):
+    """Caches the attribute names of the objects being completed on, so that
+    only the first character typed after a dot has to list them and every
+    further one just filters the cached names.
+
+    Entries are keyed by the id of the object and only used while it is still
+    the same object of the same type. Executed code may add or remove
+    attributes, so the cache is cleared by `namespace_changed`."""
+
+    def __init__(self, size=100):
+        self.size = size
+        self.entries = {}
+
+    def names(self, obj):
+        entry = self.entries.get(id(obj))
+        if entry is not None:
+            ref, type_, names = entry
+            if ref() is obj and type(obj) is type_:
+                return names
+        with inspection.AttrCleaner(obj):
+            names = attr_names(obj)
+        try:
+            ref = weakref.ref(obj)
+        except TypeError:
+            # Not weakly referenceable, keep it alive until the next clear so
+            # its id can't be reused
+            ref = lambda: obj
+        if len(self.entries) >= self.size:
+            self.entries.clear()
+        self.entries[id(obj)] = (ref, type(obj), names)
+        return names
+
+    def clear(self):
+        self.entries.clear()
+
+attr_cache = AttrCache()
+
+# Incremented whenever executed code may have changed a namespace
+namespace_generation = 0
+
+def namespace_changed():
+    """Forget everything derived from the namespaces completed on. Called
+    by the interpreters after running code."""
+    global namespace_generation
+    namespace_generation += 1
+    attr_cache.clear()
 
-    matches = []
-    n = len(attr)
-    for word in words:
-        if method_match(word, n, attr, autocomplete_mode) and word != "__builtins__":
-            matches.append("%s.%s" % (expr, word))
-    return matches
+def attr_lookup(obj, expr, attr, autocomplete_mode):
+    """Second half of original attr_matches method, the attributes of obj
+    matching attr prefixed with expr."""
+    words = attr_cache.names(obj)
+    matcher = Matcher(attr, autocomplete_mode)
+    return ["%s.%s" % (expr, word) for word in matcher.rank(words)
+            if word != "__builtins__"]
 
 def _callable_postfix(value, word):
     """rlcompleter's _callable_postfix done right."""
@@ -393,14 +460,88 @@ def _callable_postfix(value, word):
             word += '('
     return word
 
-#TODO use method_match everywhere instead of startswith to implement other completion modes
-#     will also need to rewrite checking mode so cseq replace doesn't happen in frontends
-def method_match(word, size, text, autocomplete_mode):
-    if autocomplete_mode == SIMPLE:
-        return word[:size] == text
-    elif autocomplete_mode == SUBSTRING:
-        s = r'.*%s.*' % text
-        return re.search(s, word)
-    else:
-        s = r'.*%s.*' % '.*'.join(list(text))
-        return re.search(s, word)
+class Matcher(object):
+    """Matches words against the text being completed in one of the
+    autocomplete modes and ranks the matching words.
+
+    Everything that depends only on the text is prepared once in the
+    constructor, so matching a whole namespace doesn't build a regular
+    expression per word. In SIMPLE mode words match if they start with the
+    text and are ranked alphabetically. In SUBSTRING mode they have to contain
+    the text and in FUZZY mode they have to contain its characters in order;
+    both are ranked by score, see `score`."""
+
+    # Added for every matched character directly following the previous one
+    CONTIGUOUS_BONUS = 2
+    # Added for every matched character at the start of a word component
+    BOUNDARY_BONUS = 3
+
+    def __init__(self, text, mode=SIMPLE):
+        self.text = text
+        self.mode = mode
+        if mode == FUZZY:
+            self.regex = re.compile('.*?'.join('(%s)' % (re.escape(c), )
+                                               for c in text))
+
+    def match(self, word):
+        if self.mode == SIMPLE:
+            return word.startswith(self.text)
+        elif self.mode == SUBSTRING:
+            return self.text in word
+        else:
+            return self.regex.search(word) is not None
+
+    def positions(self, word):
+        """Return the indices of the characters of word matched by the text,
+        or None if word doesn't match."""
+        if self.mode == SIMPLE:
+            if not word.startswith(self.text):
+                return None
+            return range(len(self.text))
+        elif self.mode == SUBSTRING:
+            index = word.find(self.text)
+            if index == -1:
+                return None
+            return range(index, index + len(self.text))
+        else:
+            match = self.regex.search(word)
+            if match is None:
+                return None
+            # The regular expression is non-greedy, so every group is the
+            # leftmost occurrence of its character after the previous one
+            return [match.start(i) for i in xrange(1, len(self.text) + 1)]
+
+    def score(self, word):
+        """Return the score of word (higher is better), or None if it doesn't
+        match. Matched characters which continue a run of matched characters
+        or start a word component (after '_' or '.', or an upper case letter
+        after a lower case one) earn a bonus, characters skipped between the
+        first and the last matched one cost a point each."""
+        positions = self.positions(word)
+        if positions is None:
+            return None
+        if not positions:
+            return 0
+        score = 0
+        previous = -2
+        for i in positions:
+            if i == previous + 1:
+                score += self.CONTIGUOUS_BONUS
+            if (i == 0 or word[i - 1] in '_.' or
+                    (word[i].isupper() and word[i - 1].islower())):
+                score += self.BOUNDARY_BONUS
+            previous = i
+        return score - (positions[-1] - positions[0] + 1 - len(positions))
+
+    def rank(self, words):
+        """Return the distinct matching words, best match first"""
+        if self.mode == SIMPLE:
+            return sorted(set(word for word in words
+                              if word.startswith(self.text)))
+        scored = []
+        for word in set(words):
+            score = self.score(word)
+            if score is not None:
+                scored.append((-score, len(word), word))
+        scored.sort()
+        return [word for _, _, word in scored]
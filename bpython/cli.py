@@ -72,7 +72,7 @@ from bpython.formatter import BPythonFormatter
 from bpython import importcompletion
 
 # This for config
-from bpython.config import Struct
+from bpython.config import Struct, get_cache_home
 
 # This for keys
 from bpython.keys import cli_key_dispatch as key_dispatch
@@ -1899,6 +1899,7 @@ def main_curses(scr, args, config, interactive=True, locals_=None,
             exit_value = e.args
         if not interactive:
             curses.raw(False)
+            clirepl.rl_history.close()
             return (exit_value, clirepl.getstdout())
     else:
         sys.path.insert(0, '')
@@ -1908,6 +1909,7 @@ def main_curses(scr, args, config, interactive=True, locals_=None,
         clirepl.write(banner)
         clirepl.write('\n')
     exit_value = clirepl.repl()
+    clirepl.rl_history.close()
     if hasattr(sys, 'exitfunc'):
         sys.exitfunc()
         delattr(sys, 'exitfunc')
@@ -1931,6 +1933,7 @@ def main(args=None, locals_=None, banner=None):
 
 
     config, options, exec_args = bpython.args.parse(args)
+    importcompletion.use_index(get_cache_home())
 
     # Save stdin, stdout and stderr for later restoration
     orig_stdin = sys.stdin
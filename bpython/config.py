@@ -15,6 +15,11 @@ def get_config_home():
     xdg_config_home = os.environ.get('XDG_CONFIG_HOME', '~/.config')
     return os.path.join(xdg_config_home, 'bpython')
 
+def get_cache_home():
+    """Returns the base directory for bpython's cache files."""
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME', '~/.cache')
+    return os.path.join(os.path.expanduser(xdg_cache_home), 'bpython')
+
 def default_config_path():
     """Returns bpython's default configuration file path."""
     return os.path.join(get_config_home(), 'config')
@@ -46,6 +51,7 @@ def loadini(struct, configfile):
             'flush_output': True,
             'highlight_show_source': True,
             'hist_file': '~/.pythonhist',
+            'hist_db': '',
             'hist_length': 100,
             'hist_duplicates': True,
             'paste_time': 0.02,
@@ -91,6 +97,8 @@ def loadini(struct, configfile):
             'list_above' : False,
             'fill_terminal' : False,
             'right_arrow_completion' : True,
+            'scrollback' : 10000,
+            'frame_rate' : 30,
         }})
     if not config.read(config_path):
         # No config file. If the user has it in the old place then complain
@@ -112,6 +120,7 @@ def loadini(struct, configfile):
     struct.highlight_show_source = config.getboolean('general',
                                                      'highlight_show_source')
     struct.hist_file = config.get('general', 'hist_file')
+    struct.hist_db = config.get('general', 'hist_db')
     struct.editor = config.get('general', 'editor')
     struct.hist_length = config.getint('general', 'hist_length')
     struct.hist_duplicates = config.getboolean('general', 'hist_duplicates')
@@ -159,6 +168,8 @@ def loadini(struct, configfile):
     struct.curtsies_list_above = config.getboolean('curtsies', 'list_above')
     struct.curtsies_fill_terminal = config.getboolean('curtsies', 'fill_terminal')
     struct.curtsies_right_arrow_completion = config.getboolean('curtsies', 'right_arrow_completion')
+    struct.curtsies_scrollback = config.getint('curtsies', 'scrollback')
+    struct.curtsies_frame_rate = config.getfloat('curtsies', 'frame_rate')
 
     color_scheme_name = config.get('general', 'color_scheme')
 
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 import code
+import heapq
 import logging
 import sys
 import time
@@ -16,13 +17,85 @@ import curtsies.events
 
 from bpython.curtsiesfrontend.repl import Repl
 from bpython.curtsiesfrontend.coderunner import SystemExitFromCodeGreenlet
+from bpython.curtsiesfrontend.filewatch import ModuleIndexEventHandler
 from bpython import args as bpargs
+from bpython.config import get_cache_home
 from bpython.translations import _
+from bpython import importcompletion
 from bpython.importcompletion import find_iterator
 
 repl = None # global for `from bpython.curtsies import repl`
 #WARNING Will be a problem if more than one repl is ever instantiated this way
 
+class RefreshScheduler(object):
+    """Decides when the main loop refreshes and paints
+
+    Refresh requests are merged: all pending requests for 'now' are handled
+    by one RefreshRequestEvent, and so are all scheduled ones that are due.
+    Painting is capped at frame_rate paints per second; a paint that is
+    skipped because of that is done when the next frame is due. Frames
+    identical to the last one rendered aren't rendered again."""
+
+    def __init__(self, frame_rate=0):
+        self.frame_interval = 1.0 / frame_rate if frame_rate > 0 else 0
+        self.now = False      # a refresh was requested for 'now'
+        self.scheduled = []   # heap of the times refreshes were requested for
+        self.last_paint = 0
+        self.paint_pending = False
+        self.last_frame = None
+
+    def request(self, when='now'):
+        if when == 'now':
+            self.now = True
+        else:
+            heapq.heappush(self.scheduled, when)
+
+    def pop_refresh(self, t):
+        """Returns when the refresh that is due at time t was requested for,
+        'now' or a time, or None if there is none"""
+        if self.now:
+            self.now = False
+            return 'now'
+        when = None
+        while self.scheduled and self.scheduled[0] <= t:
+            when = heapq.heappop(self.scheduled)
+        return when
+
+    def timeout(self, t, timeout):
+        """Returns how long to wait for input at time t: at most timeout,
+        and no longer than until the next refresh or pending paint is due"""
+        if self.now:
+            return 0
+        if self.scheduled:
+            timeout = min(timeout, self.scheduled[0] - t)
+        if self.paint_pending:
+            timeout = min(timeout, self.last_paint + self.frame_interval - t)
+        return max(timeout, 0)
+
+    def may_paint(self, t):
+        """Returns whether a frame may be painted at time t, or else
+        remembers to paint once it may"""
+        if t - self.last_paint >= self.frame_interval:
+            return True
+        self.paint_pending = True
+        return False
+
+    def paint_due(self, t):
+        return self.paint_pending and t - self.last_paint >= self.frame_interval
+
+    def painted(self, t, array, cursor_pos, size):
+        """Records that a frame was painted at time t. Returns whether it
+        differs from the last one and needs to be rendered."""
+        self.last_paint = t
+        self.paint_pending = False
+        frame = (size, cursor_pos, array.rows)
+        last_frame, self.last_frame = self.last_frame, frame
+        if last_frame is None or last_frame[:2] != frame[:2]:
+            return True
+        rows, last_rows = frame[2], last_frame[2]
+        return (len(rows) != len(last_rows) or
+                any(a is not b and not a == b for a, b in izip(rows, last_rows)))
+
 def main(args=None, locals_=None, banner=None):
     config, options, exec_args = bpargs.parse(args, (
         'scroll options', None, [
@@ -42,6 +115,9 @@ def main(args=None, locals_=None, banner=None):
     else:
         logging.getLogger('bpython').setLevel(logging.WARNING)
 
+    importcompletion.use_index(get_cache_home())
+    importcompletion.watcher = ModuleIndexEventHandler()
+
     interp = None
     paste = None
     if exec_args:
@@ -64,7 +140,11 @@ def main(args=None, locals_=None, banner=None):
         sys.path.insert(0, '') # expected for interactive sessions (vanilla python does it)
 
 
-    mainloop(config, locals_, banner, interp, paste, interactive=(not exec_args))
+    try:
+        mainloop(config, locals_, banner, interp, paste, interactive=(not exec_args))
+    finally:
+        if importcompletion.watcher:
+            importcompletion.watcher.stop()
 
 def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True):
     with curtsies.input.Input(keynames='curtsies', sigint_event=True) as input_generator:
@@ -78,11 +158,12 @@ def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True)
             reload_requests = []
             def request_reload(desc):
                 reload_requests.append(curtsies.events.ReloadEvent([desc]))
-            refresh_requests = []
-            def request_refresh(when='now'):
-                refresh_requests.append(curtsies.events.RefreshRequestEvent(when=when))
+            scheduler = RefreshScheduler(config.curtsies_frame_rate)
+            request_refresh = scheduler.request
 
             def event_or_refresh(timeout=None):
+                """Yields events, or None when a paint is due or timeout
+                passed without any"""
                 if timeout is None:
                     timeout = .2
                 else:
@@ -90,14 +171,16 @@ def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True)
                 starttime = time.time()
                 while True:
                     t = time.time()
-                    refresh_requests.sort(key=lambda r: 0 if r.when == 'now' else r.when)
-                    if refresh_requests and (refresh_requests[0].when == 'now' or refresh_requests[-1].when < t):
-                        yield refresh_requests.pop(0)
+                    when = scheduler.pop_refresh(t)
+                    if when is not None:
+                        yield curtsies.events.RefreshRequestEvent(when=when)
                     elif reload_requests:
                         e = reload_requests.pop()
                         yield e
+                    elif scheduler.paint_due(t):
+                        yield None
                     else:
-                        e = input_generator.send(timeout)
+                        e = input_generator.send(scheduler.timeout(t, timeout))
                         if starttime + timeout < time.time() or e is not None:
                             yield e
 
@@ -115,7 +198,8 @@ def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True)
                 repl.height, repl.width = window.t.height, window.t.width
 
                 def process_event(e):
-                    """If None is passed in, just paint the screen"""
+                    """If None is passed in, just paint the screen (if the
+                    frame rate allows it)"""
                     try:
                         if e is not None:
                             repl.process_event(e)
@@ -125,16 +209,20 @@ def mainloop(config, locals_, banner, interp=None, paste=None, interactive=True)
                         repl.scroll_offset += scrolled
                         raise
                     else:
+                        if not scheduler.may_paint(time.time()):
+                            return
                         array, cursor_pos = repl.paint()
-                        scrolled = window.render_to_terminal(array, cursor_pos)
-                        repl.scroll_offset += scrolled
+                        if scheduler.painted(time.time(), array, cursor_pos,
+                                             (repl.height, repl.width)):
+                            scrolled = window.render_to_terminal(array, cursor_pos)
+                            repl.scroll_offset += scrolled
 
                 if paste:
                     process_event(paste)
 
                 process_event(None) #priming the pump (do a display before waiting for first event) 
                 for _, e in izip(find_iterator, event_or_refresh(0)):
-                    if e is not None:
+                    if e is not None or scheduler.paint_due(time.time()):
                         process_event(e)
                 for e in event_or_refresh():
                     process_event(e)
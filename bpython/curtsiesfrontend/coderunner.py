@@ -12,6 +12,7 @@ sense to you.
 import code
 import signal
 import sys
+import time
 import greenlet
 import logging
 
@@ -68,13 +69,17 @@ class CodeRunner(object):
     just passes whatever is passed in to run_code(for_code) to the
     code greenlet
     """
-    def __init__(self, interp=None, stuff_a_refresh_request=lambda:None):
+    def __init__(self, interp=None, stuff_a_refresh_request=lambda:None,
+                 refresh_interval=0):
         """
         interp is an interpreter object to use. By default a new one is
         created.
 
         stuff_a_refresh_request is a function that will be called each time
         the running code asks for a refresh - to, for example, update the screen.
+
+        refresh_interval is the minimum time in seconds between refreshes
+        requested with request_refresh, e.g. by writing output.
         """
         self.interp = interp or code.InteractiveInterpreter()
         self.source = None
@@ -84,6 +89,11 @@ class CodeRunner(object):
         self.code_is_waiting = False # waiting for response from main thread
         self.sigint_happened_in_main_greenlet = False # sigint happened while in main thread
         self.orig_sigint_handler = None
+        self.refresh_interval = refresh_interval
+        self.last_refresh = 0 # when the main greenlet last returned from a refresh
+        self.refresh_skipped = False # a refresh was requested but not done
+        self.refresh_due = False # the interval since a skipped one is over
+        self.orig_refresh_timer_handler = None
 
     @property
     def running(self):
@@ -101,6 +111,12 @@ class CodeRunner(object):
         self.source = None
         self.code_greenlet = None
         self.code_is_waiting = False
+        self.refresh_skipped = False
+        self.refresh_due = False
+        if self.refresh_timer_installed():
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+            signal.signal(signal.SIGVTALRM, self.orig_refresh_timer_handler)
+        self.orig_refresh_timer_handler = None
 
     def run_code(self, for_code=None):
         """Returns Truthy values if code finishes, False otherwise
@@ -114,6 +130,13 @@ class CodeRunner(object):
             self.code_greenlet = greenlet.greenlet(self._blocking_run_code)
             self.orig_sigint_handler = signal.getsignal(signal.SIGINT)
             signal.signal(signal.SIGINT, self.sigint_handler)
+            if (self.refresh_interval and hasattr(signal, 'setitimer') and
+                    signal.getitimer(signal.ITIMER_VIRTUAL) == (0, 0)):
+                # The timer isn't used if some other code (e.g. a profiler)
+                # already has one
+                self.orig_refresh_timer_handler = signal.getsignal(
+                    signal.SIGVTALRM)
+                signal.signal(signal.SIGVTALRM, self.refresh_timer_handler)
             request = self.code_greenlet.switch()
         else:
             assert self.code_is_waiting
@@ -150,6 +173,22 @@ class CodeRunner(object):
             logger.debug('sigint while fufilling code request sigint handler running!')
             self.sigint_happened_in_main_greenlet = True
 
+    def refresh_timer_handler(self, *args):
+        """SIGVTALRM handler to use while code is running: marks the refresh
+        skipped by request_refresh as due once the interval is over
+
+        The refresh itself isn't done here, switching greenlets could
+        interrupt code that isn't reentrant. The timer only counts CPU time,
+        so it doesn't cut short a sleep or a blocking read either."""
+        if self.refresh_skipped:
+            self.refresh_due = True
+
+    def refresh_timer_installed(self):
+        """Returns whether refresh_timer_handler is still the SIGVTALRM
+        handler, i.e. the code being run hasn't installed its own"""
+        return (self.orig_refresh_timer_handler is not None and
+                signal.getsignal(signal.SIGVTALRM) == self.refresh_timer_handler)
+
     def _blocking_run_code(self):
         try:
             unfinished = self.interp.runsource(self.source)
@@ -170,18 +209,44 @@ class CodeRunner(object):
             raise KeyboardInterrupt()
         return value
 
+    def request_refresh(self, force=False):
+        """Request a refresh from the main greenlet unless the last one was
+        less than refresh_interval ago
+
+        Code that writes a lot of output would otherwise switch greenlets and
+        repaint the screen for every write. Everything written before a
+        skipped refresh is shown by the next one: the next write once the
+        interval is over (which refresh_timer_handler keeps track of), a
+        flush, a read from stdin or the end of the code."""
+        now = time.time()
+        if (not force and not self.refresh_due and
+                now - self.last_refresh < self.refresh_interval):
+            if not self.refresh_skipped and self.refresh_timer_installed():
+                signal.setitimer(signal.ITIMER_VIRTUAL,
+                                 self.last_refresh + self.refresh_interval - now)
+            self.refresh_skipped = True
+            return None
+        if self.refresh_skipped and self.refresh_timer_installed():
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+        self.refresh_skipped = False
+        self.refresh_due = False
+        value = self.request_from_main_greenlet(force_refresh=True)
+        self.last_refresh = time.time()
+        return value
+
 class FakeOutput(object):
     def __init__(self, coderunner, on_write):
         self.coderunner = coderunner
         self.on_write = on_write
     def write(self, *args, **kwargs):
         self.on_write(*args, **kwargs)
-        return self.coderunner.request_from_main_greenlet(force_refresh=True)
+        return self.coderunner.request_refresh()
     def writelines(self, l):
         for s in l:
             self.write(s)
     def flush(self):
-        pass
+        if self.coderunner.refresh_skipped:
+            self.coderunner.request_refresh(force=True)
     def isatty(self):
         return True
 
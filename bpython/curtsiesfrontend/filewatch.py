@@ -10,6 +10,8 @@ try:
 except ImportError:
     def ModuleChangedEventHandler(*args):
         return None
+    def ModuleIndexEventHandler(*args):
+        return None
 else:
     class ModuleChangedEventHandler(FileSystemEventHandler):
         def __init__(self, paths, on_change):
@@ -65,6 +67,42 @@ else:
             if event.src_path in paths:
                 self.on_change(event.src_path)
 
+    class ModuleIndexEventHandler(FileSystemEventHandler):
+        """Keeps the import completion module index up to date by telling
+        importcompletion about modules and directories which are created,
+        deleted or renamed."""
+        def __init__(self):
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.started = False
+
+        def watch(self, directory):
+            """Watch a directory searched by importcompletion"""
+            try:
+                self.observer.schedule(self, directory, recursive=False)
+            except OSError:
+                # Gone already, or out of inotify watches
+                return
+            if not self.started:
+                self.started = True
+                self.observer.start()
+
+        def stop(self):
+            if self.started:
+                self.observer.stop()
+                self.observer.join()
+
+        def on_any_event(self, event):
+            if event.event_type == 'modified':
+                return
+            paths = [event.src_path]
+            if hasattr(event, 'dest_path'):
+                paths.append(event.dest_path)
+            suffixes = tuple(importcompletion.SUFFIXES)
+            for path in paths:
+                if event.is_directory or path.endswith(suffixes):
+                    importcompletion.module_changed(path)
+
 if __name__ == '__main__':
     m = ModuleChangedEventHandler([])
     m.add_module('./wdtest.py')
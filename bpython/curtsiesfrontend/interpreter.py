@@ -8,6 +8,7 @@ from curtsies.bpythonparse import parse
 from codeop import CommandCompiler, compile_command
 from pygments.lexers import get_lexer_by_name
 from pygments.styles import get_style_by_name
+from bpython import autocomplete
 
 default_colors = {
         Generic.Error:'R',
@@ -77,6 +78,15 @@ class Interp(code.InteractiveInterpreter):
         self.write = lambda stuff: sys.stderr.write(stuff)
         self.outfile = self
 
+    def runcode(self, code_obj):
+        """Execute a code object. It may have changed the namespaces
+        completion information was derived from, so that is forgotten
+        afterwards."""
+        try:
+            code.InteractiveInterpreter.runcode(self, code_obj)
+        finally:
+            autocomplete.namespace_changed()
+
     def showsyntaxerror(self, filename=None):
         """Display the syntax error that just occurred.
 
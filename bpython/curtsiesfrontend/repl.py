@@ -32,20 +32,19 @@ import bpython
 from bpython.repl import Repl as BpythonRepl
 from bpython.config import Struct, loadini, default_config_path
 from bpython.formatter import BPythonFormatter
-from bpython import autocomplete, importcompletion
+from bpython import importcompletion
 from bpython import translations; translations.init()
 from bpython.translations import _
 from bpython._py3compat import py3
 
 from bpython.curtsiesfrontend import replpainter as paint
+from bpython.curtsiesfrontend.scrollback import Scrollback
 from bpython.curtsiesfrontend import sitefix; sitefix.monkeypatch_quit()
 from bpython.curtsiesfrontend.coderunner import CodeRunner, FakeOutput
 from bpython.curtsiesfrontend.filewatch import ModuleChangedEventHandler
 from bpython.curtsiesfrontend.interaction import StatusBar
 from bpython.curtsiesfrontend.manual_readline import edit_keys
 
-#TODO other autocomplete modes (also fix in other bpython implementations)
-
 
 from curtsies.configfile_keynames import keymap as key_dispatch
 print 'hello'
@@ -250,7 +249,6 @@ class Repl(BpythonRepl):
                 banner = _('Welcome to bpython!') + ' ' + (_('Press <%s> for help.') % config.help_key)
             else:
                 banner = None
-        config.autocomplete_mode = autocomplete.SIMPLE # only one implemented currently
         if config.cli_suggestion_width <= 0 or config.cli_suggestion_width > 1:
             config.cli_suggestion_width = 1
 
@@ -289,6 +287,7 @@ class Repl(BpythonRepl):
                                         # so we're just using the same object
         self._current_line = '' # line currently being edited, without ps1 (usually '>>> ')
         self.current_stdouterr_line = '' # current line of output - stdout and stdin go here
+        self._display_lines = None
         self.display_lines = [] # lines separated whenever logical line
                                 # length goes over what the terminal width
                                 # was at the time of original output
@@ -303,7 +302,9 @@ class Repl(BpythonRepl):
         self._cursor_offset = 0 # from the left, 0 means first char
         self.orig_tcattrs = orig_tcattrs # useful for shelling out with normal terminal
 
-        self.coderunner = CodeRunner(self.interp, self.request_refresh)
+        self.coderunner = CodeRunner(self.interp, self.request_refresh,
+                                     refresh_interval=(1.0 / config.curtsies_frame_rate
+                                                       if config.curtsies_frame_rate > 0 else 0))
         self.stdout = FakeOutput(self.coderunner, self.send_to_stdout)
         self.stderr = FakeOutput(self.coderunner, self.send_to_stderr)
         self.stdin = FakeStdin(self.coderunner, self, self.edit_keys)
@@ -319,6 +320,10 @@ class Repl(BpythonRepl):
         self.watching_files = False    # auto reloading turned on
         self.special_mode = None       # 'reverse_incremental_search' and 'incremental_search'
         self.incremental_search_target = ''
+        self.render_cache = None       # current_line_formatted by its inputs, during a paint
+        self.history_painter = paint.HistoryPainter() # history rows painted for the last frame
+        self.painted_regions = {}      # region name -> (inputs, array) of the last frame
+        self.buffer_wrap_cache = paint.WrapCache() # display lines of the lines in display_buffer
 
         self.original_modules = sys.modules.keys()
 
@@ -372,6 +377,7 @@ class Repl(BpythonRepl):
         sys.stderr = self.orig_stderr
         signal.signal(signal.SIGWINCH, self.orig_sigwinch_handler)
         __builtins__['__import__'] = self.orig_import
+        self.rl_history.close()
 
     def sigwinch_handler(self, signum, frame):
         old_rows, old_columns = self.height, self.width
@@ -533,8 +539,7 @@ class Repl(BpythonRepl):
             self.add_normal_character(e)
 
     def last_word(self):
-        the_history=self.rl_history.entries
-        the_line=the_history.pop()
+        the_line=self.rl_history.entries[-1]
         the_word=the_line.split().pop()
         self.current_line=self.current_line +the_word
 
@@ -870,20 +875,21 @@ class Repl(BpythonRepl):
         return '\n'.join(self.buffer + [self.current_line])
 
     def send_to_stdout(self, output):
+        if '\n' not in output:
+            self.current_stdouterr_line += output
+            return
         lines = output.split('\n')
-        logger.debug('display_lines: %r', self.display_lines)
-        self.current_stdouterr_line += lines[0]
-        if len(lines) > 1:
-            self.display_lines.extend(paint.display_linize(self.current_stdouterr_line, self.width, blank_line=True))
-            self.display_lines.extend(sum([paint.display_linize(line, self.width, blank_line=True) for line in lines[1:-1]], []))
-            self.current_stdouterr_line = lines[-1]
-        logger.debug('display_lines: %r', self.display_lines)
+        lines[0] = self.current_stdouterr_line + lines[0]
+        self.current_stdouterr_line = lines.pop()
+        for line in lines:
+            self.display_lines.extend(paint.display_linize(line, self.width, blank_line=True))
 
     def send_to_stderr(self, error):
         lines = error.split('\n')
         if lines[-1]:
             self.current_stdouterr_line += lines[-1]
-        self.display_lines.extend(sum([paint.display_linize(line, self.width, blank_line=True) for line in lines[:-1]], []))
+        for line in lines[:-1]:
+            self.display_lines.extend(paint.display_linize(line, self.width, blank_line=True))
 
     def send_to_stdin(self, line):
         if line.endswith('\n'):
@@ -904,7 +910,20 @@ class Repl(BpythonRepl):
 
     @property
     def current_line_formatted(self):
-        """The colored current line (no prompt, not wrapped)"""
+        """The colored current line (no prompt, not wrapped)
+
+        While painting it is only highlighted once for every state of the
+        things it depends on."""
+        if self.render_cache is None:
+            return self.format_current_line()
+        key = (len(self.buffer), self.current_line, self.cursor_offset,
+               self.special_mode, self.incremental_search_target,
+               self.rl_history.saved_line)
+        if key not in self.render_cache:
+            self.render_cache[key] = self.format_current_line()
+        return self.render_cache[key]
+
+    def format_current_line(self):
         if self.config.syntax:
             fs = bpythonparse(format(self.tokenize(self.current_line), self.formatter))
             if self.special_mode:
@@ -921,22 +940,37 @@ class Repl(BpythonRepl):
         self.old_fs = fs
         return fs
 
+    @property
+    def display_lines(self):
+        """Display lines of everything before the current buffer, the older
+        ones only as plain text on disk"""
+        return self._display_lines
+
+    @display_lines.setter
+    def display_lines(self, lines):
+        if self._display_lines is not None:
+            self._display_lines.close()
+        self._display_lines = Scrollback(lines, self.config.curtsies_scrollback)
+
     @property
     def lines_for_display(self):
         """All display lines (wrapped, colored, with prompts)"""
         return self.display_lines + self.display_buffer_lines
 
+    def display_lines_tail(self, rows):
+        """The last (at least) rows lines of lines_for_display, without
+        copying all of the scrollback"""
+        return (self.display_lines[-rows:] if rows > 0 else []) + self.display_buffer_lines
+
     @property
     def display_buffer_lines(self):
         """The display lines (wrapped, colored, with prompts) for the current buffer"""
-        lines = []
-        for display_line in self.display_buffer:
-            display_line = (func_for_letter(self.config.color_scheme['prompt_more'])(self.ps2)
-                           if lines else
-                           func_for_letter(self.config.color_scheme['prompt'])(self.ps1)) + display_line
-            for line in paint.display_linize(display_line, self.width):
-                lines.append(line)
-        return lines
+        ps1 = func_for_letter(self.config.color_scheme['prompt'])(self.ps1)
+        ps2 = func_for_letter(self.config.color_scheme['prompt_more'])(self.ps2)
+        return self.buffer_wrap_cache.wrap_lines(
+            [((id(display_line), self.ps2 if i else self.ps1), ps2 if i else ps1, display_line)
+             for i, display_line in enumerate(self.display_buffer)],
+            self.width)
 
     @property
     def display_line_with_prompt(self):
@@ -969,8 +1003,10 @@ class Repl(BpythonRepl):
 
     @property
     def current_suggestion(self):
-        matches = [e for e in self.rl_history.entries if e.startswith(self.current_line) and self.current_line]
-        return matches[-1][len(self.current_line):] if matches else ''
+        if not self.current_line:
+            return ''
+        match = self.rl_history.last_entry_starting_with(self.current_line)
+        return match[len(self.current_line):] if match else ''
 
     @property
     def current_output_line(self):
@@ -990,6 +1026,13 @@ class Repl(BpythonRepl):
         to worry about that here, instead every frame is completely redrawn because
         less state is cool!
         """
+        self.render_cache = {}
+        try:
+            return self.paint_frame(about_to_exit, user_quit)
+        finally:
+            self.render_cache = None
+
+    def paint_frame(self, about_to_exit, user_quit):
         # The hairiest function in the curtsies - a cleanup would be great.
 
         if about_to_exit:
@@ -1000,7 +1043,8 @@ class Repl(BpythonRepl):
         if show_status_bar:
             min_height -= 1
 
-        current_line_start_row = len(self.lines_for_display) - max(0, self.scroll_offset)
+        num_lines_for_display = len(self.display_lines) + len(self.display_buffer_lines)
+        current_line_start_row = num_lines_for_display - max(0, self.scroll_offset)
         #current_line_start_row = len(self.lines_for_display) - self.scroll_offset
         if self.request_paint_to_clear_screen: # or show_status_bar and about_to_exit ?
             self.request_paint_to_clear_screen = False
@@ -1020,16 +1064,21 @@ class Repl(BpythonRepl):
             # move screen back up a screen minus a line
             while current_line_start_row < 0:
                 self.scroll_offset = self.scroll_offset - self.height
-                current_line_start_row = len(self.lines_for_display) - max(-1, self.scroll_offset)
+                current_line_start_row = num_lines_for_display - max(-1, self.scroll_offset)
 
-            history = paint.paint_history(max(0, current_line_start_row - 1), width, self.lines_for_display)
+            history_rows = max(0, current_line_start_row - 1)
+            history = self.history_painter.paint(history_rows, width, self.display_lines_tail(history_rows))
             arr[1:history.height+1,:history.width] = history
 
             if arr.height <= min_height:
                 arr[min_height, 0] = ' ' # force scroll down to hide broken history message
         else:
-            history = paint.paint_history(current_line_start_row, width, self.lines_for_display)
-            arr[:history.height,:history.width] = history
+            history = self.history_painter.paint(current_line_start_row, width,
+                                                 self.display_lines_tail(current_line_start_row))
+            if arr.height:
+                arr[:history.height,:history.width] = history
+            else:
+                arr = paint.rows_fsarray(history.rows, width)
 
         current_line = paint.paint_current_line(min_height, width, self.current_cursor_line)
         if user_quit: # quit() or exit() in interp
@@ -1042,9 +1091,9 @@ class Repl(BpythonRepl):
         if current_line.height > min_height:
             return arr, (0, 0) # short circuit, no room for infobox
 
-        lines = paint.display_linize(self.current_cursor_line+'X', width)
+        num_lines = paint.display_line_count(len(self.current_cursor_line)+1, width)
                                        # extra character for space for the cursor
-        current_line_end_row = current_line_start_row + len(lines) - 1
+        current_line_end_row = current_line_start_row + num_lines - 1
 
         if self.stdin.has_focus:
             cursor_row, cursor_column = divmod(len(self.current_stdouterr_line) + self.stdin.cursor_offset, width)
@@ -1063,14 +1112,15 @@ class Repl(BpythonRepl):
             visible_space_below = min_height - current_line_end_row - 1
 
             info_max_rows = max(visible_space_above, visible_space_below)
-            infobox = paint.paint_infobox(info_max_rows,
-                                          int(width * self.config.cli_suggestion_width),
-                                          self.matches_iter.matches,
-                                          self.argspec,
-                                          self.current_match,
-                                          self.docstring,
-                                          self.config,
-                                          self.matches_iter.completer.format if self.matches_iter.completer else None)
+            infobox_args = (info_max_rows,
+                            int(width * self.config.cli_suggestion_width),
+                            self.matches_iter.matches,
+                            self.argspec,
+                            self.current_match,
+                            self.docstring,
+                            self.config,
+                            self.matches_iter.completer.format if self.matches_iter.completer else None)
+            infobox = self.painted_region('infobox', infobox_args, paint.paint_infobox)
 
             if visible_space_above >= infobox.height and self.config.curtsies_list_above:
                 arr[current_line_start_row - infobox.height:current_line_start_row, 0:infobox.width] = infobox
@@ -1084,7 +1134,8 @@ class Repl(BpythonRepl):
                 if about_to_exit:
                     arr[max(arr.height, min_height), :] = FSArray(1, width)
                 else:
-                    arr[max(arr.height, min_height), :] = paint.paint_statusbar(1, width, self.status_bar.current_line, self.config)
+                    arr[max(arr.height, min_height), :] = self.painted_region(
+                        'statusbar', (1, width, self.status_bar.current_line, self.config), paint.paint_statusbar)
 
                     if self.presentation_mode:
                         rows = arr.height
@@ -1096,7 +1147,8 @@ class Repl(BpythonRepl):
                 if about_to_exit:
                     arr[statusbar_row, :] = FSArray(1, width)
                 else:
-                    arr[statusbar_row, :] = paint.paint_statusbar(1, width, self.status_bar.current_line, self.config)
+                    arr[statusbar_row, :] = self.painted_region(
+                        'statusbar', (1, width, self.status_bar.current_line, self.config), paint.paint_statusbar)
 
         if self.config.color_scheme['background'] not in ('d', 'D'):
             for r in range(arr.height):
@@ -1106,6 +1158,15 @@ class Repl(BpythonRepl):
         return arr, (cursor_row, cursor_column)
 
 
+    def painted_region(self, region, args, paint_region):
+        """Returns paint_region(*args), reusing the array painted for region
+        in an earlier frame if args haven't changed since"""
+        painted = self.painted_regions.get(region)
+        if painted is None or painted[0] != args:
+            painted = (args, paint_region(*args))
+            self.painted_regions[region] = painted
+        return painted[1]
+
     @contextlib.contextmanager
     def in_paste_mode(self):
         orig_value = self.paste_mode
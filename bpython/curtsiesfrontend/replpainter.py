@@ -2,7 +2,7 @@
 import logging
 import os
 
-from curtsies import fsarray, fmtstr
+from curtsies import fsarray, fmtstr, FSArray
 from curtsies.bpythonparse import func_for_letter
 from curtsies.formatstring import linesplit
 from curtsies.fmtfuncs import bold
@@ -21,6 +21,8 @@ def display_linize(msg, columns, blank_line=False):
     """Returns lines obtained by splitting msg over multiple lines.
 
     Warning: if msg is empty, returns an empty list of lines"""
+    if 0 < len(msg) <= columns:
+        return [msg]
     display_lines = ([msg[start:end]
                       for start, end in zip(
                           range(0, len(msg), columns),
@@ -28,6 +30,53 @@ def display_linize(msg, columns, blank_line=False):
                      if msg else ([''] if blank_line else []))
     return display_lines
 
+def display_line_count(length, columns, blank_line=False):
+    """Returns len(display_linize(msg, columns, blank_line)) for a msg of
+    length characters, without splitting it"""
+    if not length:
+        return 1 if blank_line else 0
+    return (length + columns - 1) // columns
+
+class WrapCache(object):
+    """Wraps logical lines with display_linize, keeping the display lines of
+    the logical lines passed to the previous call.
+
+    Only display lines for the current width are kept: after a resize, lines
+    are rewrapped when they are asked for again."""
+
+    def __init__(self):
+        self.columns = None
+        self.wrapped = {}
+
+    def wrap_lines(self, lines, columns):
+        """Returns the display lines of lines, a list of (key, prefix, line)
+        tuples for which prefix + line is wrapped.
+
+        A key has to identify the prefixed line: for unchanged lines the
+        display lines from the last call are returned, with their identity."""
+        if columns != self.columns:
+            self.columns = columns
+            self.wrapped = {}
+        wrapped = {}
+        display_lines = []
+        for key, prefix, line in lines:
+            if key in self.wrapped:
+                entry = self.wrapped[key]
+            else:
+                # the line is kept so an id() in the key can't be reused
+                entry = (line, display_linize(prefix + line, columns))
+            wrapped[key] = entry
+            display_lines.extend(entry[1])
+        self.wrapped = wrapped
+        return display_lines
+
+def rows_fsarray(rows, columns):
+    """Like fsarray(rows, width=columns), but for FmtStrs known to fit, which
+    are used as they are instead of being copied into blank rows"""
+    arr = FSArray(0, columns)
+    arr.rows = list(rows)
+    return arr
+
 def paint_history(rows, columns, display_lines):
     lines = []
     for r, line in zip(range(rows), display_lines[-rows:]):
@@ -37,6 +86,37 @@ def paint_history(rows, columns, display_lines):
     assert r.shape[1] <= columns, repr(r.shape)+' '+repr(columns)
     return r
 
+class HistoryPainter(object):
+    """Paints history like paint_history, but keeps the rows painted for the
+    previous frame so that only display lines it didn't show are painted.
+
+    Display lines are recognised by identity: lines already in the history
+    are never changed, new ones are new objects."""
+
+    def __init__(self):
+        self.columns = None
+        self.lines = []
+        self.rows = []
+        self.array = fsarray([])
+
+    def paint(self, rows, columns, display_lines):
+        lines = display_lines[-rows:] if rows > 0 else []
+        if columns != self.columns:
+            self.columns = columns
+            self.lines, self.rows = [], []
+        elif (len(lines) == len(self.lines) and
+              all(a is b for a, b in zip(lines, self.lines))):
+            return self.array
+        painted = dict((id(line), row) for line, row in zip(self.lines, self.rows))
+        self.rows = [painted[id(line)] if id(line) in painted
+                     else fmtstr(line[:columns])
+                     for line in lines]
+        self.lines = lines
+        self.array = rows_fsarray(self.rows, columns)
+        assert self.array.shape[0] <= max(rows, 0), repr(self.array.shape)+' '+repr(rows)
+        assert self.array.shape[1] <= columns, repr(self.array.shape)+' '+repr(columns)
+        return self.array
+
 def paint_current_line(rows, columns, current_display_line):
     lines = display_linize(current_display_line, columns, True)
     return fsarray(lines, width=columns)
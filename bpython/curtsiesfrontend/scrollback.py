@@ -0,0 +1,99 @@
+"""Display lines of a session, with the older ones kept on disk
+
+Only the last screenful or so of display lines is ever painted again, but
+everything printed in a session is needed for saving it, pastebinning it and
+showing it in an external pager. A Scrollback keeps a bounded number of
+recent display lines (colored FmtStrs) in memory and writes older ones to a
+temporary file as plain text, which is all those need.
+"""
+
+import locale
+import tempfile
+
+from curtsies import FmtStr
+
+
+class Scrollback(object):
+    """List-like collection of display lines: it can be extended, measured,
+    iterated over and indexed, but lines can't be changed or removed.
+
+    At least the last `length` lines are kept in memory, older ones are
+    spilled to disk a batch at a time. A length of 0 keeps every line in
+    memory."""
+
+    def __init__(self, lines=(), length=0):
+        self.length = length
+        self.lines = []      # in memory, the last len(self.lines) lines
+        self.spilled = 0     # number of lines written to self.file
+        self.file = None
+        self.extend(lines)
+
+    def __len__(self):
+        return self.spilled + len(self.lines)
+
+    def __iter__(self):
+        for line in self.spilled_lines():
+            yield line
+        for line in self.lines:
+            yield line
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if start >= self.spilled and step == 1:
+                return self.lines[start - self.spilled:stop - self.spilled]
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if index >= self.spilled:
+            return self.lines[index - self.spilled]
+        if index < 0:
+            raise IndexError('scrollback index out of range')
+        return self.spilled_lines()[index]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return '<Scrollback of %d lines, %d on disk>' % (len(self),
+                                                         self.spilled)
+
+    def append(self, line):
+        self.extend([line])
+
+    def extend(self, lines):
+        self.lines.extend(lines)
+        if self.length and len(self.lines) > self.length + self.batch_size():
+            self.spill(len(self.lines) - self.length)
+
+    def batch_size(self):
+        """How many lines more than length are kept before spilling, so that
+        lines are written in batches and the list isn't shifted per line"""
+        return max(self.length // 4, 1)
+
+    def spill(self, count):
+        """Write the oldest count lines in memory to disk"""
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix='bpython-scrollback-')
+        self.file.seek(0, 2)
+        for line in self.lines[:count]:
+            if isinstance(line, FmtStr):
+                line = line.s
+            if not isinstance(line, unicode):
+                # the file is read back as utf-8, whatever code printed
+                line = line.decode(locale.getpreferredencoding() or 'ascii',
+                                   'replace')
+            self.file.write(line.encode('utf-8') + b'\n')
+        del self.lines[:count]
+        self.spilled += count
+
+    def spilled_lines(self):
+        """The lines written to disk, without formatting"""
+        if not self.spilled:
+            return []
+        self.file.seek(0)
+        return self.file.read().decode('utf-8', 'replace').split(u'\n')[:-1]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
@@ -23,74 +23,213 @@
 from __future__ import with_statement
 
 from bpython import line as lineparts
+import atexit
+import bisect
+import hashlib
 import imp
 import os
 import sys
-import warnings
+import tempfile
+import threading
+import time
+import zipfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from multiprocessing import cpu_count
+except ImportError:
+    cpu_count = None
 
 if sys.version_info[0] == 3 and sys.version_info[1] >= 3:
     import importlib.machinery
     SUFFIXES = importlib.machinery.all_suffixes()
+    # zipimport can't load extension modules
+    ZIP_SUFFIXES = (importlib.machinery.SOURCE_SUFFIXES +
+                    importlib.machinery.BYTECODE_SUFFIXES)
 else:
     SUFFIXES = [suffix for suffix, mode, type in imp.get_suffixes()]
-
-try:
-    from warnings import catch_warnings
-except ImportError:
-    import contextlib
-    @contextlib.contextmanager
-    def catch_warnings():
-        """Stripped-down version of `warnings.catch_warnings()`
-        (available in Py >= 2.6)."""
-        filters = warnings.filters
-        warnings.filters = list(filters)
-        try:
-            yield
-        finally:
-            warnings.filters = filters
+    ZIP_SUFFIXES = [suffix for suffix, mode, type in imp.get_suffixes()
+                    if type in (imp.PY_SOURCE, imp.PY_COMPILED)]
 
 from bpython._py3compat import py3
 
+class ModuleTrie(object):
+    """Set of dotted module names stored as a tree of name components, so
+    that the submodules of a package can be found without looking at any
+    other module."""
+
+    def __init__(self, names=()):
+        self.children = {}
+        self.is_module = False
+        self._sorted_children = None
+        self._len = 0
+        self.update(names)
+
+    def _node(self, name, create=False):
+        node = self
+        for component in name.split('.'):
+            child = node.children.get(component)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[component] = ModuleTrie()
+                node._sorted_children = None
+            node = child
+        return node
+
+    def add(self, name):
+        node = self._node(name, create=True)
+        if not node.is_module:
+            node.is_module = True
+            self._len += 1
+
+    def update(self, names):
+        for name in names:
+            self.add(name)
+
+    def discard(self, name):
+        """Remove `name` and all of its submodules."""
+        parent, _, component = name.rpartition('.')
+        node = self._node(parent) if parent else self
+        if node is None or component not in node.children:
+            return
+        removed = node.children.pop(component)
+        node._sorted_children = None
+        self._len -= sum(1 for _ in removed) + (1 if removed.is_module else 0)
+
+    def clear(self):
+        self.children.clear()
+        self._sorted_children = None
+        self._len = 0
+
+    def __contains__(self, name):
+        node = self._node(name)
+        return node is not None and node.is_module
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        stack = [('', self)]
+        while stack:
+            prefix, node = stack.pop()
+            for component, child in node.children.iteritems():
+                name = prefix + component
+                if child.is_module:
+                    yield name
+                if child.children:
+                    stack.append((name + '.', child))
+
+    def children_matching(self, package, start):
+        """Return the full names of the modules directly inside `package`
+        (the top level if empty) whose last component starts with `start`."""
+        node = self._node(package) if package else self
+        if node is None:
+            return []
+        if node._sorted_children is None:
+            node._sorted_children = sorted(node.children)
+        names = node._sorted_children
+        prefix = package + '.' if package else ''
+        matches = []
+        for i in xrange(bisect.bisect_left(names, start), len(names)):
+            component = names[i]
+            if not component.startswith(start):
+                break
+            if node.children[component].is_module:
+                matches.append(prefix + component)
+        return matches
+
+
 # The cached list of all known modules
-modules = set()
+modules = ModuleTrie()
 fully_loaded = False
+# Packages whose submodules haven't been searched yet by a lazy scan, mapped to
+# their directories, see `expand_package`
+unexpanded_packages = {}
+# Searched directories, mapped to the prefixes ('' or 'package.') of the
+# modules found in them
+directory_prefixes = {}
+# Optional filesystem watcher. Its watch(directory) method is called for
+# every searched directory and it should call `module_changed` whenever a
+# module or directory is created, deleted or renamed in one of them.
+watcher = None
+# Directories passed to `invalidate`, waiting for `apply_changes`
+changed_directories = queue.Queue()
+# The threads of scans in progress, and the event telling them to stop, see
+# `stop_scans`
+scan_threads = set()
+stop_scanning = threading.Event()
+
+# The persistent module index: maps the absolute path of every scanned
+# directory to its mtime and the (name, package directory) pairs found in it,
+# and of every zip archive to its (mtime, size) and the module names found in
+# it, so that only paths which changed since the last run are rescanned.
+INDEX_VERSION = 3
+index = {}
+index_filename = None
+# Paths visited during the current full scan, see `find_all_modules`
+indexed_paths = set()
 
 
-def module_matches(cw, prefix=''):
-    """Modules names to replace cw with"""
+def module_matches(cw, prefix='', matcher=None):
+    """Modules names to replace cw with
+
+    `matcher` is called with the text being completed and should return an
+    autocomplete.Matcher, by default module names have to start with it."""
     full = '%s.%s' % (prefix, cw) if prefix else cw
-    matches = [name for name in modules
-               if (name.startswith(full) and
-                   name.find('.', len(full)) == -1)]
+    package, _, start = full.rpartition('.')
+    apply_changes()
+    if package:
+        expand_package(package)
+    if matcher is None:
+        matches = modules.children_matching(package, start)
+    else:
+        names = dict((name.rpartition('.')[2], name)
+                     for name in modules.children_matching(package, ''))
+        matches = [names[name] for name in matcher(start).rank(names)]
     if prefix:
         return [match[len(prefix)+1:] for match in matches]
     else:
         return matches
 
-def attr_matches(cw, prefix='', only_modules=False):
+def attr_matches(cw, prefix='', only_modules=False, matcher=None):
     """Attributes to replace name with"""
     full = '%s.%s' % (prefix, cw) if prefix else cw
     module_name, _, name_after_dot = full.rpartition('.')
     if module_name not in sys.modules:
         return []
     module = sys.modules[module_name]
+    if matcher is None:
+        names = [name for name in dir(module) if name.startswith(name_after_dot)]
+    else:
+        names = matcher(name_after_dot).rank(dir(module))
     if only_modules:
-        matches = [name for name in dir(module)
-                if name.startswith(name_after_dot) and
-                '%s.%s' % (module_name, name) in sys.modules]
+        matches = [name for name in names
+                if '%s.%s' % (module_name, name) in sys.modules]
     else:
-        matches = [name for name in dir(module) if name.startswith(name_after_dot)]
+        matches = names
     module_part, _, _ = cw.rpartition('.')
     if module_part:
         return ['%s.%s' % (module_part, m) for m in matches]
     return matches
 
-def module_attr_matches(name):
+def module_attr_matches(name, matcher=None):
     """Only attributes which are modules to replace name with"""
-    return attr_matches(name, prefix='', only_modules=True)
+    return attr_matches(name, prefix='', only_modules=True, matcher=matcher)
+
+def complete(cursor_offset, line, matcher=None):
+    """Construct a full list of possibly completions for imports.
 
-def complete(cursor_offset, line):
-    """Construct a full list of possibly completions for imports."""
+    See `module_matches` for `matcher`."""
     tokens = line.split()
     if 'from' not in tokens and 'import' not in tokens:
         return None
@@ -103,86 +242,396 @@ def complete(cursor_offset, line):
         if lineparts.current_from_import_import(cursor_offset, line) is not None:
             # `from a import <b|>` completion
             return (module_matches(lineparts.current_from_import_import(cursor_offset, line)[2],
-                                   lineparts.current_from_import_from(cursor_offset, line)[2]) +
+                                   lineparts.current_from_import_from(cursor_offset, line)[2],
+                                   matcher) +
                     attr_matches(lineparts.current_from_import_import(cursor_offset, line)[2],
-                                 lineparts.current_from_import_from(cursor_offset, line)[2]))
+                                 lineparts.current_from_import_from(cursor_offset, line)[2],
+                                 matcher=matcher))
         else:
             # `from <a|>` completion
-            return (module_attr_matches(lineparts.current_from_import_from(cursor_offset, line)[2]) +
-                    module_matches(lineparts.current_from_import_from(cursor_offset, line)[2]))
+            return (module_attr_matches(lineparts.current_from_import_from(cursor_offset, line)[2], matcher) +
+                    module_matches(lineparts.current_from_import_from(cursor_offset, line)[2], matcher=matcher))
     elif lineparts.current_import(cursor_offset, line):
         # `import <a|>` completion
-        return (module_matches(lineparts.current_import(cursor_offset, line)[2]) +
-                module_attr_matches(lineparts.current_import(cursor_offset, line)[2]))
+        return (module_matches(lineparts.current_import(cursor_offset, line)[2], matcher=matcher) +
+                module_attr_matches(lineparts.current_import(cursor_offset, line)[2], matcher))
     else:
         return None
 
-def find_modules(path):
-    """Find all modules (and packages) for a given directory."""
-    if not os.path.isdir(path):
-        # Perhaps a zip file
-        return
+def scan_directory(path):
+    """Return a list of (name, directory) pairs for all modules and possible
+    packages in the directory `path`. The directory is None for plain modules,
+    otherwise it is only a package if it contains an `__init__` module.
 
+    Only the directory listing is used, so nothing is opened or imported."""
     try:
         filenames = os.listdir(path)
     except EnvironmentError:
         filenames = []
-    for name in filenames:
-        if not any(name.endswith(suffix) for suffix in SUFFIXES):
+    entries = []
+    seen = set()
+    for filename in filenames:
+        for suffix in SUFFIXES:
+            if filename.endswith(suffix):
+                name = filename[:-len(suffix)]
+                break
+        else:
+            name = None
+        subpath = os.path.join(path, filename)
+        if name is None:
             # Possibly a package
-            if '.' in name:
+            if '.' in filename or not os.path.isdir(subpath):
                 continue
-        elif os.path.isdir(os.path.join(path, name)):
+            name = filename
+        elif os.path.isdir(subpath):
             # Unfortunately, CPython just crashes if there is a directory
             # which ends with a python extension, so work around.
             continue
-        for suffix in SUFFIXES:
-            if name.endswith(suffix):
-                name = name[:-len(suffix)]
-                break
+        else:
+            subpath = None
         if py3 and name == "badsyntax_pep3120":
             # Workaround for issue #166
             continue
-        try:
-            with catch_warnings():
-                warnings.simplefilter("ignore", ImportWarning)
-                fo, pathname, _ = imp.find_module(name, [path])
-        except (ImportError, IOError, SyntaxError):
-            continue
-        except UnicodeEncodeError:
-            # Happens with Python 3 when there is a filename in some
-            # invalid encoding
+        if name not in seen:
+            seen.add(name)
+            entries.append((name, subpath))
+    return entries
+
+
+def directory_modules(path):
+    """Like `scan_directory`, but answered from the module index if `path`
+    has not been modified since it was indexed."""
+    path = os.path.abspath(path)
+    try:
+        mtime = os.stat(path).st_mtime
+    except EnvironmentError:
+        return []
+    indexed_paths.add(path)
+    cached = index.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    entries = scan_directory(path)
+    index[path] = (mtime, entries)
+    return entries
+
+
+def scan_archive(archive, prefix=''):
+    """Return a list with all module names in the zip file `archive`, below
+    the directory `prefix` inside of it. Only the archive's central directory
+    is read, nothing is extracted or imported."""
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            filenames = zf.namelist()
+    except (zipfile.BadZipfile, EnvironmentError, RuntimeError):
+        return []
+    module_paths = set()
+    for filename in filenames:
+        if not filename.startswith(prefix):
             continue
-        else:
-            if fo is not None:
-                fo.close()
+        for suffix in ZIP_SUFFIXES:
+            if filename.endswith(suffix):
+                module_paths.add(tuple(filename[len(prefix):-len(suffix)]
+                                       .split('/')))
+                break
+    packages = set(parts[:-1] for parts in module_paths
+                   if parts[-1] == '__init__')
+    names = []
+    for parts in module_paths:
+        if parts[-1] == '__init__':
+            parts = parts[:-1]
+            if not parts:
+                continue
+        if all(parts[:i] in packages for i in range(1, len(parts))):
+            names.append('.'.join(parts))
+    return names
+
+
+def archive_modules(path):
+    """Like `scan_archive` for a path entry like archive.zip or
+    archive.egg/subdir, but answered from the module index if the archive has
+    not been modified since it was indexed. Returns an empty list if `path`
+    is not inside of a zip file."""
+    path = os.path.abspath(path)
+    archive = path
+    while not os.path.isfile(archive):
+        parent = os.path.dirname(archive)
+        if parent == archive:
+            return []
+        archive = parent
+    try:
+        stat = os.stat(archive)
+    except EnvironmentError:
+        return []
+    stamp = (stat.st_mtime, stat.st_size)
+    indexed_paths.add(path)
+    cached = index.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    prefix = path[len(archive) + 1:].replace(os.sep, '/')
+    names = scan_archive(archive, prefix + '/' if prefix else '')
+    index[path] = (stamp, names)
+    return names
+
+
+def is_package(entries):
+    """Whether a directory with `entries` from `directory_modules` is a
+    package."""
+    return any(name == '__init__' for name, _ in entries)
+
+
+def package_modules(directory, prefix, package, jobs=None):
+    """Return the modules found directly in `directory`, prefixed with
+    `prefix`, as (name, package directory) pairs, or None if `package` is
+    True and the directory isn't a package.
+
+    Possible subpackages are queued on `jobs` to be searched. Without `jobs`,
+    subpackages are returned with their directory instead, which is None for
+    everything else."""
+    entries = directory_modules(directory)
+    if package:
+        if not is_package(entries):
+            return None
+        found = [(prefix[:-1], None)]
+    else:
+        found = []
+    for name, package_path in entries:
+        if package_path is None:
+            if not (package and name == '__init__'):
+                found.append((prefix + name, None))
+        elif jobs is not None:
+            jobs.put((package_path, '%s%s.' % (prefix, name), True))
+        elif is_package(directory_modules(package_path)):
+            found.append((prefix + name, package_path))
+    return found
+
+
+def scan_worker(jobs, results, lazy):
+    """Worker thread body: list the directories from `jobs` and put a
+    (directory, prefix, modules) tuple for each of them on `results`, until
+    None is received. The directory is None for zip files."""
+    while True:
+        job = jobs.get()
+        try:
+            if job is None:
+                return
+            if stop_scanning.is_set():
+                # Skip the remaining directories
+                continue
+            directory, prefix, package = job
+            if package or os.path.isdir(directory):
+                found = package_modules(directory, prefix, package,
+                                        None if lazy else jobs)
+                if found is not None:
+                    results.put((os.path.abspath(directory), prefix, found))
             else:
-                # Yay, package
-                for subname in find_modules(pathname):
-                    if subname != '__init__':
-                        yield '%s.%s' % (name, subname)
-            yield name
+                found = [(name, None) for name in archive_modules(directory)]
+                results.put((None, prefix, found))
+        finally:
+            jobs.task_done()
+
 
+def add_module(module, package_path=None):
+    """Add a module found by a scan to `modules`. If `package_path` is given,
+    the submodules of the package in that directory are added once they are
+    asked for."""
+    if not py3 and not isinstance(module, unicode):
+        try:
+            module = module.decode(sys.getfilesystemencoding())
+        except UnicodeDecodeError:
+            # Not importable anyway, ignore it
+            return
+    modules.add(module)
+    if package_path is not None:
+        unexpanded_packages.setdefault(module, []).append(package_path)
 
-def find_all_modules(path=None):
-    """Return a list with all modules in `path`, which should be a list of
-    directory names. If path is not given, sys.path will be used."""
-    if path is None:
+
+def add_directory(directory, prefix):
+    """Remember that the modules in `directory` have been added with
+    `prefix`, and let the watcher know about the directory."""
+    prefixes = directory_prefixes.setdefault(directory, set())
+    if not prefixes and watcher is not None:
+        watcher.watch(directory)
+    prefixes.add(prefix)
+
+
+def expand_package(name):
+    """Add the submodules of the package `name` and of its parent packages
+    to `modules`, if a lazy scan skipped them."""
+    parts = name.split('.')
+    for i in range(1, len(parts) + 1):
+        package = '.'.join(parts[:i])
+        for directory in unexpanded_packages.pop(package, ()):
+            found = package_modules(directory, package + '.', True)
+            if found is None:
+                continue
+            add_directory(os.path.abspath(directory), package + '.')
+            for module, package_path in found:
+                add_module(module, package_path)
+
+
+def invalidate(directory):
+    """Note that modules were created, deleted or renamed in `directory`.
+    This may be called from any thread, `modules` is only updated the next
+    time modules are completed."""
+    changed_directories.put(os.path.abspath(directory))
+
+
+def module_changed(path):
+    """Note that the module or directory `path` was created, deleted or
+    renamed. Creating or deleting an `__init__` module turns its directory
+    into a package or back, which changes the modules of the directory
+    containing it."""
+    directory = os.path.dirname(path)
+    invalidate(directory)
+    filename = os.path.basename(path)
+    if any(filename == '__init__' + suffix for suffix in SUFFIXES):
+        invalidate(os.path.dirname(directory))
+
+
+def apply_changes():
+    """Update `modules` and the module index for all directories passed to
+    `invalidate`, without rescanning anything else."""
+    directories = set()
+    while True:
+        try:
+            directories.add(changed_directories.get_nowait())
+        except queue.Empty:
+            break
+    # The directories which weren't searched themselves may be packages
+    # in one which was, their listing is read again when it is rescanned
+    for directory in directories:
+        if directory not in directory_prefixes:
+            index.pop(directory, None)
+    # Packages go before the directories containing them, whose rescan
+    # lists them again and would hide what changed in them
+    for directory in sorted(directories, key=len, reverse=True):
+        prefixes = directory_prefixes.get(directory)
+        if prefixes:
+            rescan_directory(directory, prefixes)
+
+
+def rescan_directory(directory, prefixes):
+    """Rescan `directory` and add or remove the modules that changed, once
+    for each of the module `prefixes` it was searched with."""
+    old = dict(index.get(directory, (None, []))[1])
+    try:
+        mtime = os.stat(directory).st_mtime
+    except EnvironmentError:
+        index.pop(directory, None)
+        entries = []
+    else:
+        entries = scan_directory(directory)
+        index[directory] = (mtime, entries)
+    new = dict(entries)
+    for prefix in prefixes:
+        for name, package_path in old.iteritems():
+            if new.get(name, False) != package_path:
+                modules.discard(prefix + name)
+                unexpanded_packages.pop(prefix + name, None)
+        if prefix and not is_package(entries):
+            # Not a package any more, which the rescan of the directory
+            # containing it takes care of
+            continue
+        for name, package_path in entries:
+            module = prefix + name
+            if package_path is None:
+                if old.get(name, False) is None:
+                    continue
+                if not (prefix and name == '__init__'):
+                    add_module(module)
+            elif is_package(directory_modules(package_path)):
+                # A directory may have become a package since, even if it
+                # was already there
+                if module not in modules:
+                    add_module(module, package_path)
+            elif module in modules:
+                # Its __init__ module is gone
+                modules.discard(module)
+                unexpanded_packages.pop(module, None)
+
+
+def find_all_modules(path=None, workers=None, lazy=False):
+    """Return an iterator adding all modules in `path`, which should be a list
+    of directory names, to `modules`. If path is not given, sys.path will be
+    used and the module index is saved afterwards.
+
+    The directories and their packages are listed concurrently by `workers`
+    threads (one per CPU by default). Each step of the iterator adds what has
+    been found so far, waiting briefly if nothing new has arrived.
+
+    If `lazy` is True, only the top-level modules and packages are searched.
+    The submodules of a package are only searched once they are completed,
+    see `expand_package`."""
+    full_scan = path is None
+    if full_scan:
         modules.update(sys.builtin_module_names)
         path = sys.path
+        indexed_paths.clear()
+    if workers is None:
+        try:
+            workers = cpu_count()
+        except (TypeError, NotImplementedError):
+            workers = 4
 
+    jobs = queue.Queue()
+    results = queue.Queue()
     for p in path:
         if not p:
             p = os.curdir
-        for module in find_modules(p):
-            if not py3 and not isinstance(module, unicode):
-                try:
-                    module = module.decode(sys.getfilesystemencoding())
-                except UnicodeDecodeError:
-                    # Not importable anyway, ignore it
-                    continue
-            modules.add(module)
-            yield
+        jobs.put((p, '', False))
+    threads = [threading.Thread(target=scan_worker,
+                                args=(jobs, results, lazy))
+               for _ in range(workers)]
+    def wait_for_workers():
+        jobs.join()
+        results.put(None)
+        for _ in threads:
+            jobs.put(None)
+    threads.append(threading.Thread(target=wait_for_workers))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    scan_threads.update(threads)
+
+    done = False
+    while not done:
+        found = []
+        try:
+            found.append(results.get(timeout=.01))
+            while True:
+                found.append(results.get_nowait())
+        except queue.Empty:
+            pass
+        for result in found:
+            if result is None:
+                done = True
+                continue
+            directory, prefix, names = result
+            if directory is not None:
+                add_directory(directory, prefix)
+            for module, package_path in names:
+                add_module(module, package_path)
+        yield
+    scan_threads.difference_update(threads)
+
+    if full_scan and index_filename is not None:
+        save_index(index_filename, dict((indexed, index[indexed])
+                                        for indexed in indexed_paths
+                                        if indexed in index))
+
+
+def stop_scans(timeout=1):
+    """Stop the threads of unfinished scans and wait for them. Threads
+    still waiting for directories while the interpreter shuts down would
+    print errors, so this is called at exit. A thread stuck on a slow or
+    hung filesystem isn't waited for longer than `timeout` seconds; being a
+    daemon thread, it doesn't keep the interpreter from exiting."""
+    stop_scanning.set()
+    deadline = time.time() + timeout
+    for thread in list(scan_threads):
+        thread.join(max(deadline - time.time(), 0))
+
+atexit.register(stop_scans)
 
 
 def find_coroutine():
@@ -199,10 +648,51 @@ def find_coroutine():
     return True
 
 
+def use_index(directory):
+    """Use a persistent module index stored in `directory`. There is one index
+    file per interpreter, as each one sees different modules."""
+    global index_filename
+    # The path may contain any characters, even undecodable ones on Python 3
+    key = hashlib.sha1(repr((sys.executable, sys.version)).encode(
+        'utf-8', 'backslashreplace'))
+    index_filename = os.path.join(directory,
+                                  'modules-%s.index' % (key.hexdigest()[:16], ))
+    load_index(index_filename)
+
+
+def load_index(filename):
+    """Load the module index from `filename`. A missing, unreadable or
+    outdated index file is ignored."""
+    try:
+        with open(filename, 'rb') as f:
+            version, directories = pickle.load(f)
+    except Exception:
+        # A corrupted pickle can raise just about anything
+        return
+    if version == INDEX_VERSION:
+        index.update(directories)
+
+
+def save_index(filename, directories):
+    """Atomically write the module index `directories` to `filename`."""
+    dirname = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((INDEX_VERSION, directories), f, 2)
+        os.rename(tmpname, filename)
+    except EnvironmentError:
+        pass
+
+
 def reload():
     """Refresh the list of known modules."""
     modules.clear()
-    for _ in find_all_modules():
+    unexpanded_packages.clear()
+    directory_prefixes.clear()
+    for _ in find_all_modules(lazy=True):
         pass
 
-find_iterator = find_all_modules()
+find_iterator = find_all_modules(lazy=True)
@@ -22,21 +22,27 @@
 #
 
 from __future__ import with_statement
+import bisect
 import code
 import codecs
+import contextlib
 import errno
 import inspect
 import logging
+import mmap
 import os
 import pydoc
+import re
 import shlex
+import shutil
 import subprocess
 import sys
 import tempfile
 import textwrap
 import traceback
 import unicodedata
-from itertools import takewhile
+from array import array
+from itertools import count, izip, takewhile
 from locale import getpreferredencoding
 from socket import error as SocketError
 from string import Template
@@ -44,14 +50,30 @@ from urllib import quote as urlquote
 from urlparse import urlparse
 from xmlrpclib import ServerProxy, Error as XMLRPCError
 
+from pygments.lexer import ExtendedRegexLexer, LexerContext
 from pygments.token import Token
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+try:
+    from sqlite3 import Error as SQLiteError
+except ImportError:
+    # No history database without sqlite3, so there are no errors from it
+    class SQLiteError(Exception):
+        pass
+
 from bpython import inspection
 from bpython._py3compat import PythonLexer, py3
 from bpython.formatter import Parenthesis
 from bpython.translations import _
 import bpython.autocomplete as autocomplete
 
+logger = logging.getLogger(__name__)
+
 
 class Interpreter(code.InteractiveInterpreter):
 
@@ -69,6 +91,15 @@ class Interpreter(code.InteractiveInterpreter):
         # Unfortunately code.InteractiveInterpreter is a classic class, so no super()
         code.InteractiveInterpreter.__init__(self, locals)
 
+    def runcode(self, code_obj):
+        """Execute a code object. It may have changed the namespaces
+        completion information was derived from, so that is forgotten
+        afterwards."""
+        try:
+            code.InteractiveInterpreter.runcode(self, code_obj)
+        finally:
+            autocomplete.namespace_changed()
+
     if not py3:
 
         def runsource(self, source, filename='<input>', symbol='single',
@@ -138,6 +169,178 @@ class Interpreter(code.InteractiveInterpreter):
             self.write(line)
 
 
+class PrefixIndex(object):
+    """A radix tree over history entries which remembers for every prefix the
+    entry added most recently starting with it. Adding an entry and looking
+    up a prefix take time proportional to their length, not to the number of
+    entries.
+
+    Nodes keep the entries added through them in a list until a lookup goes
+    past them, and only then sort them into children. Building the index for
+    a long history is therefore cheap, and only the parts of the tree which
+    are looked up get built."""
+
+    class Node(object):
+        __slots__ = ('label', 'depth', 'children', 'latest', 'pending')
+
+        def __init__(self, label, depth):
+            self.label = label  # the characters on the edge to this node
+            self.depth = depth  # the length of the prefix it stands for
+            self.children = {}  # first character of their label -> node
+            self.latest = None  # the last entry added through this node
+            self.pending = None # entries not sorted into children yet
+
+    def __init__(self, entries=()):
+        self.root = self.Node('', 0)
+        self.root.pending = list(entries)
+        if self.root.pending:
+            self.root.latest = self.root.pending[-1]
+
+    def add(self, entry):
+        node = self.root
+        node.latest = entry
+        i = 0
+        while i < len(entry):
+            if node.pending is not None:
+                node.pending.append(entry)
+                return
+            child = node.children.get(entry[i])
+            if child is None:
+                child = node.children[entry[i]] = self.Node(entry[i:],
+                                                            len(entry))
+                child.latest = entry
+                return
+            label = child.label
+            if entry.startswith(label, i):
+                # Most entries follow existing edges all the way down
+                common = len(label)
+            else:
+                common = 1
+                while (common < len(label) and i + common < len(entry) and
+                       label[common] == entry[i + common]):
+                    common += 1
+            if common < len(label):
+                # Split the edge where entry leaves it
+                middle = node.children[entry[i]] = self.Node(label[:common],
+                                                             i + common)
+                middle.latest = child.latest
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                child = middle
+            child.latest = entry
+            node = child
+            i += common
+
+    def expand(self, node):
+        """Sort the pending entries of node into its children"""
+        depth = node.depth
+        groups = {}
+        for entry in node.pending:
+            if len(entry) > depth:
+                group = groups.get(entry[depth])
+                if group is None:
+                    groups[entry[depth]] = [entry]
+                else:
+                    group.append(entry)
+        node.pending = None
+        for char, group in groups.iteritems():
+            prefix = os.path.commonprefix([min(group), max(group)])
+            child = node.children[char] = self.Node(prefix[depth:],
+                                                    len(prefix))
+            child.latest = group[-1]
+            if len(group) > 1:
+                child.pending = group
+
+    def latest(self, prefix):
+        """The entry added most recently starting with prefix, or None"""
+        node = self.root
+        i = 0
+        while i < len(prefix):
+            if node.pending is not None:
+                self.expand(node)
+            node = node.children.get(prefix[i])
+            if node is None:
+                return None
+            length = min(len(node.label), len(prefix) - i)
+            if node.label[:length] != prefix[i:i + length]:
+                return None
+            i += length
+        return node.latest
+
+
+class TrigramIndex(object):
+    """An index of history entries by the substrings of length three they
+    contain. The entries containing a search term are among those containing
+    each of its trigrams, so only the entries with its rarest trigram need to
+    be looked at.
+
+    Entries are identified by sequence numbers which increase in the order
+    they were added, starting with start. Removed entries are not forgotten,
+    the caller has to skip them."""
+
+    length = 3
+
+    def __init__(self, start=0):
+        self.start = start  # the lowest sequence number in it
+        self.postings = {}  # trigram -> array of sequence numbers
+        self.size = 0       # entries added
+
+    def add(self, entry, seq):
+        get = self.postings.get
+        for i in xrange(len(entry) - self.length + 1):
+            trigram = entry[i:i + self.length]
+            postings = get(trigram)
+            if postings is None:
+                postings = self.postings[trigram] = array('l')
+            if not postings or postings[-1] != seq:
+                postings.append(seq)
+        self.size += 1
+
+    def candidates(self, term, bound, backward=True):
+        """Yield the sequence numbers of the entries which may contain term,
+        from the one nearest to bound going backward (or forward), excluding
+        bound itself. The term must be at least three characters long."""
+        rarest = None
+        for i in xrange(len(term) - self.length + 1):
+            postings = self.postings.get(term[i:i + self.length])
+            if postings is None:
+                return
+            if rarest is None or len(postings) < len(rarest):
+                rarest = postings
+        if backward:
+            for i in xrange(bisect.bisect_left(rarest, bound) - 1, -1, -1):
+                yield rarest[i]
+        else:
+            for i in xrange(bisect.bisect_right(rarest, bound), len(rarest)):
+                yield rarest[i]
+
+
+@contextlib.contextmanager
+def locked_history_file(filename):
+    """Open a history file for appending, holding an exclusive lock on it
+    so that other sessions wait for this one to finish writing to it and
+    reading it back. A session compacting the file replaces it while
+    holding the lock, a session waiting for the lock meanwhile notices that
+    once it gets it and locks the new file instead."""
+    while True:
+        hfile = open(filename, 'ab')
+        if fcntl is None:
+            break
+        fcntl.flock(hfile.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(hfile.fileno()), os.stat(filename)):
+                break
+        except OSError:
+            # It has been removed
+            pass
+        hfile.close()
+    try:
+        yield hfile
+    finally:
+        # Closing it releases the lock
+        hfile.close()
+
+
 class History(object):
     """Stores readline-style history and current place in it"""
 
@@ -150,18 +353,175 @@ class History(object):
                         # where 0 is the saved typed line, 1 the prev entered line
         self.saved_line = '' # what was on the prompt before using history
         self.duplicates = duplicates
+        self.file_id = None  # (device, inode) of the history file read from
+        self.file_offset = 0 # how much of it has been read
+        self.file_lines = 0  # how many lines it contains up to there
+        self.file_entries = len(self.entries) # entries read from it or before
+
+    # The entries should be changed through the methods below, which keep
+    # entry_counts (entry -> how often it is in the list) up to date, or
+    # replaced. When the list changes length otherwise, the counts are
+    # recomputed the next time they are needed.
+
+    def _get_entries(self):
+        return self._entries
+
+    def _set_entries(self, entries):
+        self._entries = entries
+        self.count_entries()
+
+    entries = property(_get_entries, _set_entries)
+
+    def count_entries(self):
+        self.entry_counts = {}
+        for entry in self._entries:
+            self.entry_counts[entry] = self.entry_counts.get(entry, 0) + 1
+        self.counted_length = len(self._entries)
+        # Sequence numbers of the entries for the trigram indexes
+        self.entry_seqs = range(len(self._entries))
+        self.next_seq = len(self._entries)
+        # Indexes of the entries by prefix and by trigram, built by extend
+        # or on demand for last_entry_starting_with and searches and kept up
+        # to date by add_entry
+        self.prefix_index = None
+        self.trigram_indexes = None
+        self.text = None  # see unindexed_text
+
+    def check_counts(self):
+        if self.counted_length != len(self._entries):
+            self.count_entries()
 
     def append(self, line):
         line = line.rstrip('\n')
         if line:
             if not self.duplicates:
-                # remove duplicates
-                try:
-                    while True:
-                        self.entries.remove(line)
-                except ValueError:
-                    pass
-            self.entries.append(line)
+                self.remove_entry(line)
+            self.add_entry(line)
+
+    def extend(self, lines):
+        """Append lines, which don't end with newlines, one after the
+        other. Unlike append it goes over them and the entries only once."""
+        lines = filter(None, lines)
+        self.check_counts()
+        if not self.duplicates:
+            # Only the last occurrence of every line counts, the entries
+            # equal to one of them go
+            last = dict(izip(lines, count()))
+            lines = sorted(last, key=last.__getitem__)
+            self.remove_entries(filter(self.entry_counts.__contains__,
+                                       lines))
+        if self.prefix_index is not None or self.trigram_indexes is not None:
+            for line in lines:
+                self.add_entry(line)
+        else:
+            self._entries.extend(lines)
+            for line in lines:
+                self.entry_counts[line] = self.entry_counts.get(line, 0) + 1
+            self.counted_length = len(self._entries)
+            self.entry_seqs.extend(xrange(self.next_seq,
+                                          self.next_seq + len(lines)))
+            self.next_seq += len(lines)
+        if self.prefix_index is None:
+            # Loading the history builds the index for suggestions, rather
+            # than the first keystroke
+            self.build_prefix_index()
+
+    def add_entry(self, line):
+        """Add line to the end of the entries, even if it is already in
+        them."""
+        self.check_counts()
+        self._entries.append(line)
+        self.entry_counts[line] = self.entry_counts.get(line, 0) + 1
+        self.counted_length += 1
+        self.entry_seqs.append(self.next_seq)
+        if self.prefix_index is not None:
+            self.prefix_index.add(line)
+        if self.trigram_indexes is not None:
+            self.trigram_indexes[0].add(line, self.next_seq)
+        self.next_seq += 1
+
+    def remove_entry(self, line):
+        """Remove all entries equal to line and return the positions they
+        had when they were removed, i.e. the positions to del in order."""
+        # Most lines entered are new, which the counts tell without looking
+        # through the entries, and most others were entered recently, so
+        # they are looked for at the end first.
+        self.check_counts()
+        positions = []
+        for unused in xrange(self.entry_counts.pop(line, 0)):
+            position = self.find_entry(line)
+            del self._entries[position]
+            del self.entry_seqs[position]
+            positions.append(position)
+            if self.text is not None and position < len(self.text[1]) - 1:
+                self.text = None
+        self.counted_length = len(self._entries)
+        return positions
+
+    # Up to this many lines are looked for one by one, from the end
+    remove_one_by_one = 64
+
+    def remove_entries(self, lines):
+        """Remove all entries equal to one of lines. The entries stay the
+        same list, and the indexes only have to skip the removed ones."""
+        if len(lines) <= self.remove_one_by_one:
+            for line in lines:
+                self.remove_entry(line)
+            return
+        # Too many to look for one by one, go over the entries once
+        self.check_counts()
+        for line in lines:
+            self.entry_counts.pop(line, None)
+        counts = self.entry_counts
+        kept = [position for position, entry in enumerate(self._entries)
+                if entry in counts]
+        self.text = None
+        self._entries[:] = [self._entries[position] for position in kept]
+        self.entry_seqs[:] = [self.entry_seqs[position] for position in kept]
+        self.counted_length = len(self._entries)
+
+    def find_entry(self, line):
+        """The position of an entry equal to line, which must exist"""
+        window = 64
+        while True:
+            start = max(0, len(self._entries) - window)
+            try:
+                return self._entries.index(line, start)
+            except ValueError:
+                if not start:
+                    raise
+            window *= 64
+
+    def truncate_entries(self, length):
+        """Remove the entries after the first length ones"""
+        self.check_counts()
+        for entry in self._entries[length:]:
+            self.entry_counts[entry] -= 1
+            if not self.entry_counts[entry]:
+                del self.entry_counts[entry]
+        del self._entries[length:]
+        del self.entry_seqs[length:]
+        if self.text is not None and length < len(self.text[1]) - 1:
+            self.text = None
+        self.counted_length = len(self._entries)
+
+    def is_indexed(self):
+        return self.prefix_index is not None
+
+    def build_prefix_index(self):
+        self.prefix_index = PrefixIndex(self.entries)
+
+    def last_entry_starting_with(self, prefix):
+        """The most recent entry starting with prefix, or None"""
+        self.check_counts()
+        if not self.is_indexed():
+            self.build_prefix_index()
+        entry = self.prefix_index.latest(prefix)
+        if entry is not None and not self.entry_counts.get(entry):
+            # It has been removed since, the index needs to forget it
+            self.build_prefix_index()
+            entry = self.prefix_index.latest(prefix)
+        return entry
 
     def first(self):
         """Move back to the beginning of the history."""
@@ -187,21 +547,51 @@ class History(object):
         """The current entry, which may be the saved line"""
         return self.entries[-self.index] if self.index else self.saved_line
 
+    def entry_at(self, index):
+        """The entry index lines back in the history, 0 is the saved line"""
+        return self._entries[-index] if index else self.saved_line
+
     @property
     def entries_by_index(self):
+        """A copy of the entries, ordered by index"""
         return list(reversed(self.entries + [self.saved_line]))
 
-    def find_match_backward(self, search_term, include_current=False):
-        for idx, val in enumerate(self.entries_by_index[self.index + (0 if include_current else 1):]):
-            if val.startswith(search_term):
-                return idx + (0 if include_current else 1)
+    # The searches walk the entries in place from the current index and
+    # return how many steps away the nearest match is.
+
+    def search_backward(self, matches, include_current):
+        start = self.index + (0 if include_current else 1)
+        for index in xrange(start, len(self._entries) + 1):
+            if matches(self.entry_at(index)):
+                return index - self.index
         return 0
 
+    def search_forward(self, matches, include_current):
+        end = max(0, self.index - (1 if include_current else 0))
+        for index in xrange(end - 1, -1, -1):
+            if matches(self.entry_at(index)):
+                return end - 1 - index + (0 if include_current else 1)
+        return self.index
+
+    def find_match_backward(self, search_term, include_current=False):
+        return self.search_backward(lambda entry: entry.startswith(search_term),
+                                    include_current)
+
     def find_partial_match_backward(self, search_term, include_current=False):
-        for idx, val in enumerate(self.entries_by_index[self.index + (0 if include_current else 1):]):
-            if search_term in val:
-                return idx + (0 if include_current else 1)
-        return 0
+        if len(search_term) < TrigramIndex.length:
+            return self.search_backward(lambda entry: search_term in entry,
+                                        include_current)
+        if include_current and self.index == 0:
+            if search_term in self.saved_line:
+                return 0
+            include_current = False
+        position = len(self.entries) - self.index
+        if include_current:
+            position += 1
+        found = self.search_trigram_index(search_term, position)
+        if found is None:
+            return 0
+        return len(self.entries) - found - self.index
 
 
     def forward(self, start=True, search=False, target=None, include_current=False):
@@ -221,17 +611,152 @@ class History(object):
             return self.saved_line
 
     def find_match_forward(self, search_term, include_current=False):
-        #TODO these are no longer efficient, because we realize the whole list. Does this matter?
-        for idx, val in enumerate(reversed(self.entries_by_index[:max(0, self.index - (1 if include_current else 0))])):
-            if val.startswith(search_term):
-                return idx + (0 if include_current else 1)
-        return self.index
+        return self.search_forward(lambda entry: entry.startswith(search_term),
+                                   include_current)
 
     def find_partial_match_forward(self, search_term, include_current=False):
-        for idx, val in enumerate(reversed(self.entries_by_index[:max(0, self.index - (1 if include_current else 0))])):
-            if search_term in val:
-                return idx + (0 if include_current else 1)
-        return self.index
+        if len(search_term) < TrigramIndex.length or include_current:
+            return self.search_forward(lambda entry: search_term in entry,
+                                       include_current)
+        position = len(self.entries) - self.index
+        found = self.search_trigram_index(search_term, position,
+                                          backward=False)
+        if found is None:
+            return self.index
+        return self.index - (len(self.entries) - found)
+
+    # Substring searches use trigram indexes of consecutive entries, newest
+    # first. The first one covers the entries added since the search started
+    # to use them. Indexing takes much longer than looking through the
+    # entries once, so the older entries are indexed one chunk per search
+    # that gets to them and the rest is looked through, joined into one
+    # string so that str.find can do it.
+
+    trigram_chunk = 512
+
+    def unindexed_length(self):
+        """The number of entries not covered by the trigram indexes"""
+        return bisect.bisect_left(self.entry_seqs, self.trigram_indexes[-1].start)
+
+    def extend_trigram_indexes(self):
+        """Index the newest chunk of the entries not covered by the trigram
+        indexes yet. Returns whether there was any."""
+        end = self.unindexed_length()
+        if not end:
+            return False
+        start = max(0, end - self.trigram_chunk)
+        index = TrigramIndex(self.entry_seqs[start] if start else 0)
+        for position in xrange(start, end):
+            index.add(self.entries[position], self.entry_seqs[position])
+        self.trigram_indexes.append(index)
+        return True
+
+    def unindexed_text(self):
+        """The entries not covered by the trigram indexes when it was
+        built, joined by newlines, and the offsets in it at which each
+        of them starts."""
+        if self.text is None:
+            entries = self.entries[:self.unindexed_length()]
+            offsets = array('l', [0])
+            offset = 0
+            for length in map(len, entries):
+                offset += length + 1
+                offsets.append(offset)
+            try:
+                self.text = ('\n'.join(entries), offsets)
+            except UnicodeError:
+                # Both undecodable bytes and unicode
+                self.text = (None, offsets)
+        return self.text
+
+    def search_unindexed(self, search_term, start, end, backward=True):
+        """Return the position of the last (or first) entry from start
+        to end containing search_term, or None."""
+        if start >= end:
+            return None
+        text, offsets = self.unindexed_text()
+        if text is None:
+            if backward:
+                positions = xrange(end - 1, start - 1, -1)
+            else:
+                positions = xrange(start, end)
+            for found in positions:
+                if search_term in self.entries[found]:
+                    return found
+            return None
+        low, high = offsets[start], offsets[end] - 1
+        while True:
+            if backward:
+                offset = text.rfind(search_term, low, high)
+            else:
+                offset = text.find(search_term, low, high)
+            if offset == -1:
+                return None
+            found = bisect.bisect_right(offsets, offset) - 1
+            if search_term in self.entries[found]:
+                return found
+            # It spans entries which contain newlines themselves
+            if backward:
+                high = offset + len(search_term) - 1
+            else:
+                low = offset + 1
+
+    def first_candidate(self, candidates, search_term):
+        """The position of the first of candidates, sequence numbers, which
+        is still an entry and contains search_term, or None."""
+        for seq in candidates:
+            found = bisect.bisect_left(self.entry_seqs, seq)
+            if (found < len(self.entries) and self.entry_seqs[found] == seq and
+                search_term in self.entries[found]):
+                return found
+        return None
+
+    def search_trigram_index(self, search_term, position, backward=True):
+        """Return the position of the nearest entry before (or after)
+        position containing search_term, or None."""
+        self.check_counts()
+        if (self.trigram_indexes is None or
+            sum(index.size for index in self.trigram_indexes) >
+            2 * len(self.entries) + 1000):
+            # Start over, without the removed entries
+            self.trigram_indexes = [TrigramIndex(self.next_seq)]
+            self.text = None
+        if backward:
+            if position <= 0:
+                return None
+            if position < len(self.entries):
+                bound = self.entry_seqs[position]
+            else:
+                bound = self.next_seq
+            for index in self.trigram_indexes:
+                found = self.first_candidate(
+                    index.candidates(search_term, bound), search_term)
+                if found is not None:
+                    return found
+            if self.extend_trigram_indexes():
+                found = self.first_candidate(
+                    self.trigram_indexes[-1].candidates(search_term, bound),
+                    search_term)
+                if found is not None:
+                    return found
+            return self.search_unindexed(
+                search_term, 0, min(position, self.unindexed_length()))
+        else:
+            if position + 1 >= len(self.entries):
+                return None
+            bound = self.entry_seqs[position]
+            found = self.search_unindexed(search_term, position + 1,
+                                          self.unindexed_length(),
+                                          backward=False)
+            if found is not None:
+                return found
+            for index in reversed(self.trigram_indexes):
+                found = self.first_candidate(
+                    index.candidates(search_term, bound, backward=False),
+                    search_term)
+                if found is not None:
+                    return found
+        return None
 
 
 
@@ -260,19 +785,101 @@ class History(object):
         return history
 
     def load(self, filename, encoding):
-        with codecs.open(filename, 'r', encoding, 'ignore') as hfile:
-            for line in hfile:
-                self.append(line)
+        self.file_id = None
+        self.reload(filename, encoding)
+
+    def reload(self, filename, encoding):
+        """Append the lines added to the history file since it was last
+        (re)loaded, e.g. by other sessions. If it has been replaced since,
+        the history is loaded from scratch instead."""
+        with open(filename, 'rb') as hfile:
+            stat = os.fstat(hfile.fileno())
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self.file_id or stat.st_size < self.file_offset:
+                if self.file_id is not None:
+                    self.entries = []
+                self.file_id = file_id
+                self.file_offset = 0
+                self.file_lines = 0
+            lines = []
+            if stat.st_size > self.file_offset:
+                data = mmap.mmap(hfile.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    # Only read complete lines, another session may be
+                    # writing the rest
+                    end = data.rfind(b'\n', self.file_offset) + 1
+                    if end:
+                        lines = data[self.file_offset:end].decode(
+                            encoding, 'ignore').split('\n')[:-1]
+                        self.file_offset = end
+                finally:
+                    data.close()
+        self.extend(lines)
+        self.file_lines += len(lines)
+        self.file_entries = len(self.entries)
+
+    def append_reload_and_write(self, s, filename, encoding, length=0):
+        """Append s to the history file and reload the lines appended since
+        the last reload. The file is only appended to, so every session
+        writing to it keeps the lines of the others. It is compacted to its
+        last length entries once it contains twice as many lines. All of
+        that happens while holding a lock on the file, so that no session
+        appends to it while another one compacts it."""
+        s = s.rstrip('\n')
+        if not s:
+            return
+        with locked_history_file(filename) as hfile:
+            writer = codecs.getwriter(encoding)(hfile, 'ignore')
+            writer.write(s)
+            writer.write('\n')
+            hfile.flush()
+            # Entries only appended in memory since, like s itself by some
+            # frontends, are replaced by what is read back from the file
+            self.truncate_entries(self.file_entries)
+            self.reload(filename, encoding)
+            if length and self.file_lines > 2 * length:
+                self.save(filename, encoding, length)
 
     def reset(self):
         self.index = 0
         self.saved_line = ''
 
+    def close(self):
+        """Called by the frontends when the session ends. The history file
+        is written to as lines are entered, so there is nothing left to do."""
+
     def save(self, filename, encoding, lines=0):
-        with codecs.open(filename, 'w', encoding, 'ignore') as hfile:
-            for line in self.entries[-lines:]:
-                hfile.write(line)
-                hfile.write('\n')
+        """Replace the history file with the last lines entries. The new file
+        is written next to it (or next to the file a symlink points to) with
+        the same mode and renamed, so other sessions notice it has been
+        replaced when they reload it. If the directory isn't writable, the
+        file is overwritten instead."""
+        filename = os.path.realpath(filename)
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename))
+        except EnvironmentError:
+            with codecs.open(filename, 'w', encoding, 'ignore') as hfile:
+                self._write_entries(hfile, lines)
+        else:
+            try:
+                if os.path.exists(filename):
+                    shutil.copymode(filename, tmpname)
+                with codecs.getwriter(encoding)(os.fdopen(fd, 'wb'), 'ignore') as hfile:
+                    self._write_entries(hfile, lines)
+                os.rename(tmpname, filename)
+            except:
+                os.unlink(tmpname)
+                raise
+        stat = os.stat(filename)
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.file_offset = stat.st_size
+        self.file_lines = len(self.entries[-lines:])
+        self.file_entries = len(self.entries)
+
+    def _write_entries(self, hfile, lines):
+        for line in self.entries[-lines:]:
+            hfile.write(line)
+            hfile.write('\n')
 
 
 class MatchesIterator(object):
@@ -291,6 +898,7 @@ class MatchesIterator(object):
         self.orig_cursor_offset = None   # cursor position in the original line
         self.orig_line = None            # original line (before match replacements)
         self.completer = None            # class describing the current type of completion
+        self.generation = None           # autocomplete.namespace_generation of the matches
 
     def __nonzero__(self):
         """MatchesIterator is False when word hasn't been replaced yet"""
@@ -326,7 +934,10 @@ class MatchesIterator(object):
         return result
 
     def is_cseq(self):
-        return bool(os.path.commonprefix(self.matches)[len(self.current_word):])
+        # In the substring and fuzzy modes matches don't necessarily start
+        # with the current word, only a common sequence extending it is used
+        cseq = os.path.commonprefix(self.matches)
+        return cseq.startswith(self.current_word) and bool(cseq[len(self.current_word):])
 
     def substitute_cseq(self):
         """Returns a new line by substituting a common sequence in, and update matches"""
@@ -340,6 +951,30 @@ class MatchesIterator(object):
                 self.clear()
         return new_cursor_offset, new_line
 
+    def narrowed(self, cursor_offset, current_line):
+        """Returns the matches for current_line if they can be found by
+        filtering the current matches, otherwise None
+
+        This is the case if the word to complete in current_line extends the
+        current word by identifier characters and the rest of the line is
+        unchanged: every match for it then also matches the current word.
+        Only valid for simple completion while the namespace is unchanged."""
+        if not self.matches or self.generation != autocomplete.namespace_generation:
+            return None
+        r = self.completer.locate(cursor_offset, current_line)
+        if r is None:
+            return None
+        start, end, word = r
+        if (start != self.start or
+                current_line[:start] != self.orig_line[:start] or
+                current_line[end:] != self.orig_line[self.end:] or
+                not word.startswith(self.current_word) or
+                # e.g. private attributes are only completed after a '_'
+                not re.search(r'\w$', self.current_word) or
+                not re.match(r'\w+$', word[len(self.current_word):])):
+            return None
+        return [match for match in self.matches if match.startswith(word)]
+
     def update(self, cursor_offset, current_line, matches, completer):
         """Called to reset the match index and update the word being replaced
 
@@ -349,6 +984,7 @@ class MatchesIterator(object):
         assert matches is not None
         self.matches = matches
         self.completer = completer
+        self.generation = autocomplete.namespace_generation
         #assert self.completer.locate(self.orig_cursor_offset, self.orig_line) is not None, (self.completer.locate, self.orig_cursor_offset, self.orig_line)
         self.index = -1
         self.start, self.end, self.current_word = self.completer.locate(self.orig_cursor_offset, self.orig_line)
@@ -362,6 +998,118 @@ class MatchesIterator(object):
         self.end = None
         self.index = -1
 
+
+class ContextPythonLexer(ExtendedRegexLexer):
+    """The Python lexer, but using a lexer context which tells in which
+    state lexing some text ended."""
+
+    flags = PythonLexer.flags
+    tokens = PythonLexer.tokens
+
+
+class LineLexer(object):
+    """Lexes source code line by line and remembers the tokens of each line
+    and the lexer state after it. Lines which haven't changed since and start
+    in the same state are not lexed again, so only the line being edited is
+    when the ones before it stay the same."""
+
+    def __init__(self):
+        self.lexer = ContextPythonLexer()
+        self.lines = []  # (state, line, tokens, state after it)
+
+    def get_tokens(self, source):
+        """Return the tokens of source like PythonLexer().get_tokens. Only
+        docstrings spanning lines are split into several tokens, and are
+        String.Double rather than String.Doc tokens."""
+        tokens = []
+        for lexed in self.lex(source):
+            tokens.extend(lexed[2])
+        return tokens
+
+    def lex(self, source):
+        """Return the remembered (state, line, tokens, state after it)
+        tuples for the lines of source. The tuple of a line is the same
+        object as long as it is not lexed again."""
+        if not isinstance(source, unicode):
+            try:
+                source = source.decode('utf-8')
+            except UnicodeDecodeError:
+                source = source.decode('latin1')
+        source = source.replace('\r\n', '\n').replace('\r', '\n')
+        source = source.strip('\n')
+        lines = source.split('\n')
+        state = ('root', )
+        for i, line in enumerate(lines):
+            if i < len(self.lines) and self.lines[i][:2] == (state, line):
+                state = self.lines[i][3]
+            else:
+                context = LexerContext(line + '\n', 0, list(state))
+                line_tokens = [(token, value) for _, token, value in
+                               self.lexer.get_tokens_unprocessed(
+                                   context=context)]
+                lexed = (state, line, line_tokens, tuple(context.stack))
+                del self.lines[i:]
+                self.lines.append(lexed)
+                state = lexed[3]
+        return self.lines[:len(lines)]
+
+
+class BracketIndex(object):
+    """Remembers for each line of the buffer the brackets still open after
+    it, so that highlighting the bracket matching the one under the cursor
+    only has to look at the current line and the innermost open brackets.
+
+    Each open bracket is a (line number, index, tokens of the line, bracket)
+    tuple. The tokens of a line are those yielded by split_lines without
+    its newline, and must not be changed."""
+
+    parens = dict(zip('{([', '})]'))
+
+    def __init__(self):
+        # (lexed line, tokens, open brackets after it, whether a closing
+        # bracket without an opening one hasn't stopped the search yet)
+        self.lines = []
+
+    def update(self, lexed_lines):
+        """Return the open brackets after the lexed lines, as returned by
+        LineLexer.lex, and whether to keep looking for brackets. Only the
+        lines which have been lexed again since the last call are looked
+        at."""
+        stack, search = (), True
+        for lineno, lexed in enumerate(lexed_lines):
+            if lineno < len(self.lines) and self.lines[lineno][0] is lexed:
+                stack, search = self.lines[lineno][2:]
+                continue
+            tokens = list(split_lines(lexed[2]))[:-1]
+            stack, search = self.scan(lineno, tokens, stack, search)
+            del self.lines[lineno:]
+            self.lines.append((lexed, tokens, stack, search))
+        return stack, search
+
+    def scan(self, lineno, tokens, stack, search):
+        stack = list(stack)
+        for i, (token, value) in enumerate(tokens):
+            if not search:
+                break
+            if token is not Token.Punctuation:
+                continue
+            if value in self.parens:
+                stack.append((lineno, i, tokens, value))
+            elif value in self.parens.itervalues():
+                saved_stack = list(stack)
+                try:
+                    while self.parens[stack.pop()[-1]] != value:
+                        pass
+                except IndexError:
+                    # SyntaxError.. more closed parentheses than
+                    # opened or a wrong closing paren
+                    if not saved_stack:
+                        search = False
+                    else:
+                        stack = saved_stack
+        return tuple(stack), search
+
+
 class Interaction(object):
     def __init__(self, config, statusbar=None):
         self.config = config
@@ -423,10 +1171,23 @@ class Repl(object):
         self.config = config
         self.cut_buffer = ''
         self.buffer = []
+        self.line_lexer = LineLexer()
+        self.bracket_index = BracketIndex()
         self.interp = interp
         self.interp.syntaxerror_callback = self.clear_current_line
         self.match = False
-        self.rl_history = History(duplicates=config.hist_duplicates)
+        self.rl_history = None
+        if config.hist_db:
+            hist_db = os.path.expanduser(config.hist_db)
+            try:
+                from bpython.sqlitehistory import SQLiteHistory
+                self.rl_history = SQLiteHistory(hist_db,
+                        duplicates=config.hist_duplicates)
+            except (ImportError, SQLiteError), err:
+                logger.error('Could not open history database %s (%s), '
+                             'using the history file', hist_db, err)
+        if self.rl_history is None:
+            self.rl_history = History(duplicates=config.hist_duplicates)
         self.s_hist = []
         self.history = []
         self.evaluating = False
@@ -446,7 +1207,9 @@ class Repl(object):
         self.closed = False
 
         pythonhist = os.path.expanduser(self.config.hist_file)
-        if os.path.exists(pythonhist):
+        # A new history database starts out with the lines of the file
+        if os.path.exists(pythonhist) and not getattr(self.rl_history,
+                                                      'last_id', 0):
             self.rl_history.load(pythonhist,
                     getpreferredencoding() or "ascii")
 
@@ -635,14 +1398,26 @@ class Repl(object):
 
         self.set_docstring()
 
-        matches, completer = autocomplete.get_completer(
-                self.cursor_offset,
-                self.current_line,
-                self.interp.locals,
-                self.argspec,
-                '\n'.join(self.buffer + [self.current_line]),
-                self.config.autocomplete_mode if hasattr(self.config, 'autocomplete_mode') else autocomplete.SIMPLE,
-                self.config.complete_magic_methods)
+        mode = (self.config.autocomplete_mode
+                if hasattr(self.config, 'autocomplete_mode')
+                else autocomplete.SIMPLE)
+        # While a word is being typed, narrow down the previous matches
+        # instead of looking everything up again
+        matches = None
+        if mode == autocomplete.SIMPLE:
+            matches = self.matches_iter.narrowed(self.cursor_offset,
+                                                 self.current_line)
+        if matches is not None:
+            completer = self.matches_iter.completer
+        else:
+            matches, completer = autocomplete.get_completer(
+                    self.cursor_offset,
+                    self.current_line,
+                    self.interp.locals,
+                    self.argspec,
+                    '\n'.join(self.buffer + [self.current_line]),
+                    mode,
+                    self.config.complete_magic_methods)
         #TODO implement completer.shown_before_tab == False (filenames shouldn't fill screen)
 
         if (matches is None            # no completion is relevant
@@ -874,16 +1649,14 @@ class Repl(object):
     def insert_into_history(self, s):
         if self.config.hist_length:
             histfilename = os.path.expanduser(self.config.hist_file)
-            oldhistory = self.rl_history.entries
-            self.rl_history.entries = []
-            if os.path.exists(histfilename):
-                self.rl_history.load(histfilename, getpreferredencoding())
-            self.rl_history.append(s)
             try:
-                self.rl_history.save(histfilename, getpreferredencoding(), self.config.hist_length)
+                self.rl_history.append_reload_and_write(s, histfilename,
+                        getpreferredencoding(), self.config.hist_length)
             except EnvironmentError, err:
                 self.interact.notify("Error occured while writing to file %s (%s) " % (histfilename, err.strerror))
-                self.rl_history.entries = oldhistory
+                self.rl_history.append(s)
+            except SQLiteError, err:
+                self.interact.notify("Error occured while writing to database %s (%s) " % (self.config.hist_db, err))
                 self.rl_history.append(s)
         else:
             self.rl_history.append(s)
@@ -935,30 +1708,31 @@ class Repl(object):
             iff that line is the not the current line
         """
 
-        source = '\n'.join(self.buffer + [s])
-        cursor = len(source) - self.cpos
+        lexed = self.line_lexer.lex('\n'.join(self.buffer + [s]))
+        if len(lexed) != len(self.buffer) + 1:
+            # Empty lines at the start or the end have been stripped
+            return list()
+        # The brackets of the buffer lines don't depend on the cursor, which
+        # is always on the current line
+        stack, search_for_paren = self.bracket_index.update(lexed[:-1])
+        stack = list(stack)
+        cursor = len(s) - self.cpos
         if self.cpos:
             cursor += 1
-        stack = list()
-        all_tokens = list(PythonLexer().get_tokens(source))
+        tokens = list(lexed[-1][2])
         # Unfortunately, Pygments adds a trailing newline and strings with
         # no size, so strip them
-        while not all_tokens[-1][1]:
-            all_tokens.pop()
-        all_tokens[-1] = (all_tokens[-1][0], all_tokens[-1][1].rstrip('\n'))
-        line = pos = 0
-        parens = dict(zip('{([', '})]'))
+        while tokens and not tokens[-1][1]:
+            tokens.pop()
+        if tokens:
+            tokens[-1] = (tokens[-1][0], tokens[-1][1].rstrip('\n'))
+        line = len(self.buffer)
+        pos = 0
+        parens = BracketIndex.parens
         line_tokens = list()
         saved_tokens = list()
-        search_for_paren = True
-        for (token, value) in split_lines(all_tokens):
+        for (token, value) in split_lines(tokens):
             pos += len(value)
-            if token is Token.Text and value == '\n':
-                line += 1
-                # Remove trailing newline
-                line_tokens = list()
-                saved_tokens = list()
-                continue
             line_tokens.append((token, value))
             saved_tokens.append((token, value))
             if not search_for_paren:
@@ -1008,14 +1782,14 @@ class Repl(object):
                             line_tokens[i] = (Parenthesis, opening)
                         else:
                             self.highlighted_paren = (lineno, list(tokens))
-                            # We need to redraw a line
+                            # We need to redraw a line, the tokens of the
+                            # bracket index must stay as they are
+                            tokens = list(tokens)
                             tokens[i] = (Parenthesis, opening)
                             self.reprint_line(lineno, tokens)
                         search_for_paren = False
                 elif under_cursor:
                     search_for_paren = False
-        if line != len(self.buffer):
-            return list()
         return line_tokens
 
     def clear_current_line(self):
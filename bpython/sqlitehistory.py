@@ -0,0 +1,311 @@
+# The MIT License
+#
+# Copyright (c) 2014 the bpython authors.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""History stored in an SQLite database.
+
+Every entered line is kept forever, together with the time it was entered,
+the session it was entered in, the working directory and whether running it
+raised an exception. Searching the history is done with queries against the
+database: substring searches use an FTS5 trigram index if the SQLite library
+supports it, prefix searches an index on the lines.
+"""
+
+import bisect
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from itertools import izip
+
+from bpython.repl import History
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    line TEXT NOT NULL,
+    time REAL,
+    session TEXT,
+    cwd TEXT,
+    status INTEGER
+);
+CREATE INDEX IF NOT EXISTS history_line ON history (line);
+"""
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_search USING fts5(
+    line, content='history', content_rowid='id',
+    tokenize='trigram case_sensitive 1');
+CREATE TRIGGER IF NOT EXISTS history_search_insert AFTER INSERT ON history
+BEGIN
+    INSERT INTO history_search (rowid, line) VALUES (new.id, new.line);
+END;
+CREATE TRIGGER IF NOT EXISTS history_search_delete AFTER DELETE ON history
+BEGIN
+    INSERT INTO history_search (history_search, rowid, line)
+        VALUES ('delete', old.id, old.line);
+END;
+"""
+
+# Shortest search term the trigram index can be used for
+TRIGRAM_LENGTH = 3
+
+
+class SQLiteHistory(History):
+    """History whose entries are the rows of an SQLite database.
+
+    The entries are loaded into memory for navigation, each with the id of
+    its row, so that the rows found by a query can be mapped back to
+    positions in the history. Without duplicates an entry has the id of the
+    last row with its line."""
+
+    def __init__(self, filename, duplicates=False, session=None):
+        History.__init__(self, duplicates=duplicates)
+        self.ids = [0] * len(self.entries)
+        self.session = session or uuid.uuid4().hex
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+        self.searchable = self.create_search_index()
+        self.connection.commit()
+        self.last_id = 0
+        self.last_written = None
+        self.last_traceback = getattr(sys, 'last_traceback', None)
+        self.db_entries = len(self.entries)
+        self.reload()
+
+    def create_search_index(self):
+        """Create the full text index if the SQLite library supports it.
+        Returns whether it can be used."""
+        exists = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'history_search'"
+            ).fetchone()
+        try:
+            self.connection.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError:
+            # No FTS5 or no trigram tokenizer
+            return False
+        if not exists:
+            # Index the rows added while it couldn't be used
+            self.connection.execute(
+                "INSERT INTO history_search (history_search) "
+                "VALUES ('rebuild')")
+        return True
+
+    def append(self, line, row_id=None):
+        line = line.rstrip('\n')
+        if not line:
+            return
+        if row_id is None:
+            # Not (yet) in the database, sorts with the last row read
+            row_id = self.ids[-1] if self.ids else 0
+        if not self.duplicates:
+            for position in self.remove_entry(line):
+                del self.ids[position]
+        self.add_entry(line)
+        self.ids.append(row_id)
+
+    def remove_entries(self, lines):
+        """Remove the entries equal to one of lines and their ids"""
+        if len(lines) <= self.remove_one_by_one:
+            for line in lines:
+                for position in self.remove_entry(line):
+                    del self.ids[position]
+            return
+        removed = set(lines)
+        self.ids[:] = [row_id for row_id, entry in izip(self.ids, self.entries)
+                       if entry not in removed]
+        History.remove_entries(self, lines)
+
+    def load(self, filename, encoding):
+        """Add the lines of a plain history file to the database"""
+        with open(filename, 'rb') as hfile:
+            lines = hfile.read().decode(encoding, 'ignore').split('\n')
+        mtime = os.path.getmtime(filename)
+        self.connection.executemany(
+            'INSERT INTO history (line, time, session) VALUES (?, ?, ?)',
+            [(line, mtime, filename) for line in lines if line])
+        self.connection.commit()
+        self.reload()
+
+    def reload(self, filename=None, encoding=None):
+        """Append the rows added since the last reload, e.g. by other
+        sessions."""
+        rows = self.connection.execute(
+            'SELECT id, line FROM history WHERE id > ? ORDER BY id',
+            (self.last_id, )).fetchall()
+        if rows:
+            self.last_id = rows[-1][0]
+        rows = [(row_id, line.rstrip('\n')) for row_id, line in rows]
+        rows = [(row_id, line) for row_id, line in rows if line]
+        if not self.duplicates:
+            # Only the last row with each line becomes an entry
+            last = dict((line, i) for i, (_, line) in enumerate(rows))
+            rows = [row for i, row in enumerate(rows) if last[row[1]] == i]
+        self.extend([line for _, line in rows])
+        self.ids.extend(row_id for row_id, _ in rows)
+        self.db_entries = len(self.entries)
+
+    def append_reload_and_write(self, s, filename, encoding, length=0):
+        """Add s to the database and reload the rows added since the last
+        reload. The filename and length of the plain history file are not
+        used."""
+        s = s.rstrip('\n')
+        if not s:
+            return
+        if not isinstance(s, unicode):
+            s = s.decode(encoding or 'ascii', 'ignore')
+        self.update_status()
+        try:
+            cwd = os.getcwd()
+        except OSError:
+            cwd = None
+        cursor = self.connection.execute(
+            'INSERT INTO history (line, time, session, cwd) '
+            'VALUES (?, ?, ?, ?)', (s, time.time(), self.session, cwd))
+        self.connection.commit()
+        self.last_written = cursor.lastrowid
+        self.truncate_entries(self.db_entries)
+        del self.ids[self.db_entries:]
+        self.reload()
+
+    def update_status(self):
+        """Record whether an exception has been shown since the last line
+        was written, i.e. whether running it failed."""
+        last_traceback = getattr(sys, 'last_traceback', None)
+        if self.last_written is not None:
+            self.connection.execute(
+                'UPDATE history SET status = ? WHERE id = ?',
+                (int(last_traceback is not self.last_traceback),
+                 self.last_written))
+            self.connection.commit()
+        self.last_traceback = last_traceback
+
+    def save(self, filename, encoding, lines=0):
+        """The database is never truncated, so there is nothing to save."""
+
+    def close(self):
+        self.update_status()
+        self.connection.close()
+
+    # Queries
+
+    # A condition is a table, an SQL expression and its arguments
+
+    def substring_condition(self, term):
+        if self.searchable and len(term) >= TRIGRAM_LENGTH:
+            return ('history_search', 'history_search MATCH ?',
+                    ['"%s"' % (term.replace('"', '""'), )])
+        return 'history', 'instr(line, ?) > 0', [term]
+
+    def prefix_condition(self, prefix):
+        if prefix and prefix[-1] < u'\ud800':
+            # Lines are compared as utf-8, where characters after u'\uffff'
+            # sort after it, so the bound is the prefix with its last
+            # character incremented instead of prefix + u'\uffff'
+            bound = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+            return 'history', 'line >= ? AND line < ?', [prefix, bound]
+        return ('history', 'line >= ? AND substr(line, 1, length(?)) = ?',
+                [prefix, prefix, prefix])
+
+    def find(self, condition, position, backward=True):
+        """Return the position of the nearest entry before (or after)
+        position whose row satisfies condition, or None."""
+        table, where, args = condition
+        if backward:
+            if position <= 0:
+                return None
+            if position < len(self.ids):
+                bound = self.ids[position]
+            else:
+                bound = self.last_id + 1
+            query = 'SELECT max(rowid) FROM %s WHERE rowid < ? AND %s' % (
+                table, where)
+        else:
+            if position + 1 >= len(self.ids):
+                return None
+            bound = self.ids[position]
+            query = 'SELECT min(rowid) FROM %s WHERE rowid > ? AND %s' % (
+                table, where)
+        while True:
+            row_id = self.connection.execute(query, [bound] + args).fetchone()[0]
+            if row_id is None:
+                return None
+            index = bisect.bisect_left(self.ids, row_id)
+            if index < len(self.ids) and self.ids[index] == row_id:
+                return index
+            # An older duplicate of an entry, keep looking past it
+            bound = row_id
+
+    def find_backward(self, condition, include_current):
+        position = len(self.entries) - self.index
+        if include_current:
+            position += 1
+        found = self.find(condition, position)
+        if found is None:
+            return 0
+        return len(self.entries) - found - self.index
+
+    def find_forward(self, condition):
+        position = len(self.entries) - self.index
+        found = self.find(condition, position, backward=False)
+        if found is None:
+            return self.index
+        return self.index - (len(self.entries) - found)
+
+    def find_match_backward(self, search_term, include_current=False):
+        if not search_term:
+            return History.find_match_backward(self, search_term,
+                                               include_current)
+        if include_current and self.index == 0:
+            if self.saved_line.startswith(search_term):
+                return 0
+            include_current = False
+        return self.find_backward(self.prefix_condition(search_term),
+                                  include_current)
+
+    def find_partial_match_backward(self, search_term, include_current=False):
+        if not search_term:
+            return History.find_partial_match_backward(self, search_term,
+                                                       include_current)
+        if include_current and self.index == 0:
+            if search_term in self.saved_line:
+                return 0
+            include_current = False
+        return self.find_backward(self.substring_condition(search_term),
+                                  include_current)
+
+    def find_match_forward(self, search_term, include_current=False):
+        if not search_term or include_current:
+            return History.find_match_forward(self, search_term,
+                                              include_current)
+        return self.find_forward(self.prefix_condition(search_term))
+
+    def find_partial_match_forward(self, search_term, include_current=False):
+        if not search_term or include_current:
+            return History.find_partial_match_forward(self, search_term,
+                                                      include_current)
+        return self.find_forward(self.substring_condition(search_term))
+
+    def last_entry_starting_with(self, prefix):
+        found = self.find(self.prefix_condition(prefix), len(self.entries))
+        return self.entries[found] if found is not None else None
@@ -0,0 +1,203 @@
+# encoding: utf-8
+"""Latency benchmarks for the completers used by autocomplete.get_completer.
+
+Every scenario builds a synthetic namespace that is much larger than what one
+usually sees in an interactive session (10k globals, objects with thousands of
+attributes, huge dicts, a 50k module import index, ...) and times a completion
+request for a partially typed word, once for the completer responsible for it
+and once for the whole get_completer chain.
+
+Run it with
+
+    python -m bpython.test.benchmark_autocomplete [-n REPEAT] [-m MODE]
+
+and compare the reported percentiles (in milliseconds) before and after
+changes to the keystroke hot path.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from optparse import OptionParser
+from timeit import default_timer
+
+from bpython import autocomplete, importcompletion
+
+
+class Namespace(object):
+    """Object whose attributes are set up by a scenario."""
+
+
+def make_globals(size):
+    namespace = {}
+    for i in xrange(size):
+        namespace['name_%d' % (i, )] = i
+    return namespace
+
+
+def make_object(size):
+    obj = Namespace()
+    for i in xrange(size):
+        setattr(obj, 'attr_%d' % (i, ), i)
+    return obj
+
+
+def make_dict(size):
+    return dict(('key_%d' % (i, ), i) for i in xrange(size))
+
+
+def make_modules(size):
+    modules = importcompletion.ModuleTrie()
+    for i in xrange(size // 10):
+        package = 'package_%d' % (i, )
+        modules.add(package)
+        modules.update('%s.module_%d' % (package, j) for j in xrange(9))
+    return modules
+
+
+def make_directory(size):
+    directory = tempfile.mkdtemp()
+    for i in xrange(size):
+        open(os.path.join(directory, 'file_%d' % (i, )), 'w').close()
+    return directory
+
+
+def make_argspec(size):
+    args = ['arg_%d' % (i, ) for i in xrange(size)]
+    return ['function', [args, None, None, None, [], None, {}]]
+
+
+def scaled(size, scale):
+    """`size` divided by `scale`, but large enough for the words completed
+    by the scenarios (like name_12 or package_12) to be there."""
+    return max(size // scale, 200)
+
+
+class Scenario(object):
+    """A line typed into the repl, the locals it is completed against and the
+    completer expected to produce its matches. get_completer reports the
+    cumulative completions as `reported_as`."""
+
+    def __init__(self, name, completer, line, locals_=None, argspec=None,
+                 full_code='', reported_as=None):
+        self.name = name
+        self.completer = completer
+        self.reported_as = reported_as or completer
+        self.line = line
+        self.kwargs = {'locals_': locals_ if locals_ is not None else {},
+                       'argspec': argspec, 'full_code': full_code or line,
+                       'complete_magic_methods': True}
+
+    def run_completer(self, mode):
+        return self.completer.matches(len(self.line), self.line,
+                                      mode=mode, **self.kwargs)
+
+    def run_chain(self, mode):
+        return autocomplete.get_completer(len(self.line), self.line,
+                                          self.kwargs['locals_'],
+                                          self.kwargs['argspec'],
+                                          self.kwargs['full_code'], mode,
+                                          True)
+
+
+def scenarios(directory, scale=1):
+    """Return all scenarios. `scale` shrinks the synthetic namespaces, a
+    scale of 1 corresponds to the full sizes."""
+    big_globals = make_globals(scaled(10000, scale))
+    big_object = make_object(scaled(5000, scale))
+    big_dict = make_dict(scaled(50000, scale))
+    return [
+        Scenario('dict keys', autocomplete.DictKeyCompletion,
+                 "d['key_12", {'d': big_dict}),
+        Scenario('import', autocomplete.ImportCompletion,
+                 'import package_12'),
+        Scenario('from import', autocomplete.ImportCompletion,
+                 'from package_12 import mod'),
+        Scenario('filename', autocomplete.FilenameCompletion,
+                 "open('%s" % (os.path.join(directory, 'file_12'), )),
+        Scenario('globals', autocomplete.GlobalCompletion,
+                 'name_12', big_globals),
+        Scenario('attributes', autocomplete.AttrCompletion,
+                 'obj.attr_12', {'obj': big_object}),
+        # GlobalCompletion takes every word not preceded by a dot, so
+        # get_completer only gets to the parameter names for a word which
+        # isn't part of a dotted name either
+        Scenario('parameter names', autocomplete.ParameterNameCompletion,
+                 'function(x).arg_12', {}, make_argspec(scaled(1000, scale)),
+                 reported_as=autocomplete.AttrCompletion),
+    ]
+
+
+@contextmanager
+def environment(scale=1):
+    """Set up the module index and the directory the scenarios complete
+    from, and yield the directory."""
+    old_modules = importcompletion.modules
+    importcompletion.modules = make_modules(scaled(50000, scale))
+    directory = make_directory(scaled(2000, scale))
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory)
+        importcompletion.modules = old_modules
+
+
+def percentile(timings, p):
+    """Return the `p`th percentile of the sorted list `timings`."""
+    index = int(round(p / 100.0 * (len(timings) - 1)))
+    return timings[index]
+
+
+def measure(f, repeat):
+    timings = []
+    for _ in xrange(repeat):
+        start = default_timer()
+        f()
+        timings.append(default_timer() - start)
+    timings.sort()
+    return timings
+
+
+def run(repeat=50, mode=autocomplete.SIMPLE, scale=1, out=sys.stdout):
+    """Time all scenarios and write a report to `out`. Returns a list of
+    (scenario name, completer timings, chain timings) tuples."""
+    results = []
+    with environment(scale) as directory:
+        header = '%-16s %-28s %9s %9s %9s %9s' % ('scenario', 'completer',
+                                                  'p50', 'p90', 'p99', 'max')
+        out.write('%s\n' % (header, ))
+        for scenario in scenarios(directory, scale):
+            completer_timings = measure(
+                lambda: scenario.run_completer(mode), repeat)
+            chain_timings = measure(lambda: scenario.run_chain(mode), repeat)
+            results.append((scenario.name, completer_timings, chain_timings))
+            for label, timings in [(scenario.completer.__name__,
+                                    completer_timings),
+                                   ('get_completer', chain_timings)]:
+                out.write('%-16s %-28s %9.3f %9.3f %9.3f %9.3f\n' % (
+                    scenario.name, label,
+                    percentile(timings, 50) * 1000,
+                    percentile(timings, 90) * 1000,
+                    percentile(timings, 99) * 1000,
+                    timings[-1] * 1000))
+    return results
+
+
+def main(args=None):
+    parser = OptionParser(usage='Usage: %prog [options]')
+    parser.add_option('-n', '--repeat', type='int', default=50,
+                      help='number of completions per scenario')
+    parser.add_option('-m', '--mode', default=autocomplete.SIMPLE,
+                      choices=[autocomplete.SIMPLE, autocomplete.SUBSTRING,
+                               autocomplete.FUZZY],
+                      help='autocomplete mode (simple, substring or fuzzy)')
+    parser.add_option('-s', '--scale', type='int', default=1,
+                      help='divide the size of all namespaces by SCALE')
+    options, _ = parser.parse_args(args)
+    run(options.repeat, options.mode, options.scale)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 from bpython import autocomplete
+from bpython.test import benchmark_autocomplete
 from functools import partial
+from StringIO import StringIO
 import inspect
 
 import unittest
@@ -34,3 +36,110 @@ class TestFormatters(unittest.TestCase):
 
     def test_attribute(self):
         self.assertEqual(autocomplete.after_last_dot('abc.edf'), 'edf')
+
+class TestMatcher(unittest.TestCase):
+    def test_simple(self):
+        matcher = autocomplete.Matcher('ba', autocomplete.SIMPLE)
+        self.assertTrue(matcher.match('bar'))
+        self.assertFalse(matcher.match('abar'))
+        self.assertEqual(matcher.rank(['baz', 'foo', 'bar', 'bar']),
+                         ['bar', 'baz'])
+
+    def test_substring(self):
+        matcher = autocomplete.Matcher('ar', autocomplete.SUBSTRING)
+        self.assertTrue(matcher.match('bar'))
+        self.assertFalse(matcher.match('abr'))
+        self.assertEqual(matcher.rank(['fooar', 'bar', 'foo_ar', 'abr']),
+                         ['foo_ar', 'bar', 'fooar'])
+
+    def test_fuzzy(self):
+        matcher = autocomplete.Matcher('br', autocomplete.FUZZY)
+        self.assertTrue(matcher.match('bar'))
+        self.assertFalse(matcher.match('rb'))
+        self.assertEqual(matcher.rank(['bxxxxr', 'bar', 'br', 'foo']),
+                         ['br', 'bar', 'bxxxxr'])
+
+    def test_fuzzy_word_boundaries(self):
+        matcher = autocomplete.Matcher('gc', autocomplete.FUZZY)
+        self.assertEqual(matcher.rank(['magic', 'get_completer']),
+                         ['get_completer', 'magic'])
+        matcher = autocomplete.Matcher('gC', autocomplete.FUZZY)
+        self.assertEqual(matcher.rank(['magiC', 'getCompleter']),
+                         ['getCompleter', 'magiC'])
+
+    def test_special_characters_are_not_regex(self):
+        for mode in [autocomplete.SUBSTRING, autocomplete.FUZZY]:
+            self.assertFalse(autocomplete.Matcher('a.', mode).match('ab'))
+            self.assertTrue(autocomplete.Matcher('a.', mode).match('a.b'))
+
+    def test_empty_text_matches_everything(self):
+        matcher = autocomplete.Matcher('', autocomplete.FUZZY)
+        self.assertEqual(matcher.rank(['bb', 'a']), ['a', 'bb'])
+
+class TestRankedMatches(unittest.TestCase):
+    def test_ranked_order_is_kept(self):
+        matches, completer = autocomplete.get_completer(
+            2, 'qz', {'qxz': 1, 'qz': 2}, None, 'qz', autocomplete.FUZZY,
+            True)
+        self.assertEqual(completer, autocomplete.GlobalCompletion)
+        self.assertEqual(matches, ['qz', 'qxz'])
+
+    def test_simple_mode_is_alphabetical(self):
+        matches, completer = autocomplete.get_completer(
+            2, 'br', {'br': 1, 'bra': 2}, None, 'br', autocomplete.SIMPLE,
+            True)
+        self.assertEqual(matches, sorted(matches))
+
+class TestAttrCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = autocomplete.AttrCache()
+
+    def test_names_are_cached(self):
+        class Foo(object):
+            pass
+        foo = Foo()
+        foo.bar = 1
+        self.assertTrue('bar' in self.cache.names(foo))
+        foo.baz = 2
+        self.assertFalse('baz' in self.cache.names(foo))
+        self.cache.clear()
+        self.assertTrue('baz' in self.cache.names(foo))
+
+    def test_objects_are_told_apart(self):
+        self.assertTrue('upper' in self.cache.names('abc'))
+        self.assertFalse('upper' in self.cache.names(1))
+        self.assertTrue('real' in self.cache.names(1))
+
+    def test_interpreter_clears_cache(self):
+        from bpython.repl import Interpreter
+        interp = Interpreter()
+        interp.runsource('Foo = type("Foo", (object, ), {})')
+        self.assertEqual(autocomplete.attr_matches('Foo.zz', interp.locals,
+                                                   autocomplete.SIMPLE), [])
+        interp.runsource('Foo.zzz = 1')
+        self.assertEqual(autocomplete.attr_matches('Foo.zz', interp.locals,
+                                                   autocomplete.SIMPLE),
+                         ['Foo.zzz'])
+
+class TestBenchmark(unittest.TestCase):
+    def test_every_scenario_completes(self):
+        out = StringIO()
+        results = benchmark_autocomplete.run(repeat=2, scale=1000, out=out)
+        names = [name for name, _, _ in results]
+        self.assertEqual(len(names), 7)
+        for name, completer_timings, chain_timings in results:
+            self.assertEqual(len(completer_timings), 2)
+            self.assertEqual(len(chain_timings), 2)
+            self.assertIn(name, out.getvalue())
+
+    def test_every_scenario_uses_its_completer(self):
+        with benchmark_autocomplete.environment(scale=1000) as directory:
+            for scenario in benchmark_autocomplete.scenarios(directory, 1000):
+                matches = scenario.run_completer(autocomplete.SIMPLE)
+                self.assertTrue(matches, scenario.name)
+                chain_matches, completer = scenario.run_chain(
+                    autocomplete.SIMPLE)
+                self.assertEqual(completer, scenario.reported_as,
+                                 scenario.name)
+                self.assertEqual(sorted(chain_matches), sorted(set(matches)),
+                                 scenario.name)
@@ -0,0 +1,102 @@
+import signal
+import time
+import unittest
+try:
+    from unittest import skipUnless
+except ImportError:
+    def skipUnless(condition, reason):
+        if condition:
+            return lambda x: x
+        else:
+            return lambda x: None
+
+from bpython.curtsiesfrontend.coderunner import CodeRunner, FakeOutput
+
+
+class TestCodeRunner(unittest.TestCase):
+    def setUp(self):
+        self.refreshes = []
+        self.output = []
+        self.coderunner = CodeRunner(
+            stuff_a_refresh_request=lambda: self.refreshes.append(
+                list(self.output)),
+            refresh_interval=60)
+        self.coderunner.interp.locals['out'] = FakeOutput(self.coderunner,
+                                                          self.output.append)
+
+    def run_to_end(self, source):
+        self.coderunner.load_code(source)
+        while not self.coderunner.run_code():
+            pass
+
+    def test_refreshes_are_throttled(self):
+        self.run_to_end('for i in range(100): out.write(str(i))\n')
+        self.assertEqual(self.output, [str(i) for i in range(100)])
+        self.assertEqual(len(self.refreshes), 1)
+
+    def test_flush_shows_skipped_output(self):
+        self.run_to_end('out.write("a"); out.write("b"); out.flush()\n')
+        self.assertEqual(self.output, ['a', 'b'])
+        self.assertEqual(len(self.refreshes), 2)
+        self.run_to_end('out.flush()\n')
+        self.assertEqual(len(self.refreshes), 2)
+
+    @skipUnless(hasattr(signal, 'setitimer'), 'needs signal.setitimer')
+    def test_timer_marks_skipped_refresh_as_due(self):
+        self.coderunner.refresh_interval = .05
+        def work():
+            start = time.time()
+            while (not self.coderunner.refresh_due and
+                   time.time() - start < 2):
+                pass
+            return self.coderunner.refresh_due
+        self.coderunner.interp.locals['work'] = work
+        self.run_to_end('out.write("a"); out.write("b"); '
+                        'work() and out.write("c")\n')
+        self.assertEqual(self.refreshes, [['a'], ['a', 'b', 'c']])
+        self.assertEqual(signal.getsignal(signal.SIGVTALRM),
+                         signal.SIG_DFL)
+
+    @skipUnless(hasattr(signal, 'setitimer'), 'needs signal.setitimer')
+    def test_timer_of_other_code_is_kept(self):
+        self.coderunner.refresh_interval = .05
+        handler = lambda *args: None
+        orig_handler = signal.signal(signal.SIGVTALRM, handler)
+        signal.setitimer(signal.ITIMER_VIRTUAL, 100)
+        try:
+            self.run_to_end('out.write("a"); out.write("b")\n')
+            self.assertEqual(signal.getsignal(signal.SIGVTALRM), handler)
+            self.assertTrue(signal.getitimer(signal.ITIMER_VIRTUAL)[0] > 0)
+        finally:
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+            signal.signal(signal.SIGVTALRM, orig_handler)
+
+    @skipUnless(hasattr(signal, 'setitimer'), 'needs signal.setitimer')
+    def test_handler_installed_by_code_is_kept(self):
+        self.coderunner.refresh_interval = .05
+        handler = lambda *args: None
+        self.coderunner.interp.locals['install'] = lambda: signal.signal(
+            signal.SIGVTALRM, handler)
+        try:
+            self.run_to_end('out.write("a"); out.write("b"); install()\n')
+            self.assertEqual(signal.getsignal(signal.SIGVTALRM), handler)
+        finally:
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+            signal.signal(signal.SIGVTALRM, signal.SIG_DFL)
+
+    @skipUnless(hasattr(signal, 'setitimer'), 'needs signal.setitimer')
+    def test_sleep_is_not_interrupted(self):
+        self.coderunner.refresh_interval = .05
+        self.coderunner.interp.locals['time'] = time
+        start = time.time()
+        self.run_to_end('out.write("a"); out.write("b"); time.sleep(.3)\n')
+        self.assertTrue(time.time() - start >= .3)
+
+    def test_unthrottled(self):
+        self.coderunner.refresh_interval = 0
+        self.run_to_end('for i in range(10): out.write(str(i))\n')
+        self.assertEqual(len(self.refreshes), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
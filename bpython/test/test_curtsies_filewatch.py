@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from watchdog.events import (FileCreatedEvent, FileDeletedEvent,
+                                 FileModifiedEvent, DirCreatedEvent)
+    has_watchdog = True
+except ImportError:
+    has_watchdog = False
+
+from bpython import importcompletion
+from bpython.curtsiesfrontend.filewatch import ModuleIndexEventHandler
+
+try:
+    from unittest import skipUnless
+except ImportError:
+    def skipUnless(condition, reason):
+        if condition:
+            return lambda x: x
+        else:
+            return lambda x: None
+
+
+@skipUnless(has_watchdog, "watchdog required")
+class TestModuleIndexEventHandler(unittest.TestCase):
+    def setUp(self):
+        self.original = (importcompletion.modules,
+                         importcompletion.unexpanded_packages,
+                         importcompletion.directory_prefixes,
+                         importcompletion.index)
+        importcompletion.modules = importcompletion.ModuleTrie()
+        importcompletion.unexpanded_packages = {}
+        importcompletion.directory_prefixes = {}
+        importcompletion.index = {}
+        self.tempdir = tempfile.mkdtemp()
+        open(os.path.join(self.tempdir, 'zzmodule.py'), 'w').close()
+        for _ in importcompletion.find_all_modules([self.tempdir]):
+            pass
+        self.handler = ModuleIndexEventHandler()
+
+    def tearDown(self):
+        (importcompletion.modules, importcompletion.unexpanded_packages,
+         importcompletion.directory_prefixes,
+         importcompletion.index) = self.original
+        shutil.rmtree(self.tempdir)
+
+    def test_module_created_and_deleted(self):
+        filename = os.path.join(self.tempdir, 'zznew.py')
+        open(filename, 'w').close()
+        self.handler.on_any_event(FileCreatedEvent(filename))
+        importcompletion.apply_changes()
+        self.assertEqual(sorted(importcompletion.modules),
+                         ['zzmodule', 'zznew'])
+        os.remove(filename)
+        self.handler.on_any_event(FileDeletedEvent(filename))
+        importcompletion.apply_changes()
+        self.assertEqual(sorted(importcompletion.modules), ['zzmodule'])
+
+    def test_package_created(self):
+        package = os.path.join(self.tempdir, 'zzpackage')
+        os.mkdir(package)
+        self.handler.on_any_event(DirCreatedEvent(package))
+        init = os.path.join(package, '__init__.py')
+        open(init, 'w').close()
+        self.handler.on_any_event(FileCreatedEvent(init))
+        importcompletion.apply_changes()
+        self.assertEqual(sorted(importcompletion.modules),
+                         ['zzmodule', 'zzpackage'])
+
+    def test_other_events_are_ignored(self):
+        filename = os.path.join(self.tempdir, 'zzmodule.py')
+        self.handler.on_any_event(FileModifiedEvent(filename))
+        readme = os.path.join(self.tempdir, 'README.txt')
+        open(readme, 'w').close()
+        self.handler.on_any_event(FileCreatedEvent(readme))
+        self.assertTrue(importcompletion.changed_directories.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,10 +5,11 @@ import os
 
 from curtsies.formatstringarray import FormatStringTest, fsarray
 
-from curtsies.fmtfuncs import *
+from curtsies.fmtfuncs import bold, cyan, green, yellow
 
 from bpython import config
 from bpython.curtsiesfrontend.repl import Repl
+from bpython.curtsiesfrontend import replpainter as paint
 from bpython.repl import History
 
 def setup_config():
@@ -63,3 +64,52 @@ class TestCurtsiesPainting(FormatStringTest):
                   u'',
                   u'Welcome to bpython! Press <F1> f']
         self.assert_paint_ignoring_formatting(screen, (0, 9))
+
+    def test_current_line_highlighted_once_per_paint(self):
+        [self.repl.add_normal_character(c) for c in '(1 + 1)']
+        calls = []
+        tokenize = self.repl.tokenize
+        def counting_tokenize(*args, **kwargs):
+            calls.append(args)
+            return tokenize(*args, **kwargs)
+        self.repl.tokenize = counting_tokenize
+        self.repl.paint()
+        self.assertEqual(len(calls), 1)
+        self.repl.paint()
+        self.assertEqual(len(calls), 2)
+
+    def test_history_rows_reused_between_frames(self):
+        self.repl.display_lines = ['line %d' % (i, ) for i in range(10000)]
+        self.repl.scroll_offset = 10000 - 2
+        screen = fsarray(['line 9998', 'line 9999', '>>> ',
+                          'Welcome to'])
+        self.assert_paint_ignoring_formatting(screen, (2, 4))
+        rows = list(self.repl.history_painter.rows)
+        self.assertEqual(len(rows), 2)
+        self.repl.add_normal_character('1')
+        screen = fsarray(['line 9998', 'line 9999', '>>> 1',
+                          'Welcome to'])
+        self.assert_paint_ignoring_formatting(screen, (2, 5))
+        self.assertTrue(all(a is b for a, b in
+                            zip(rows, self.repl.history_painter.rows)))
+
+
+class TestWrapping(unittest.TestCase):
+    def test_display_line_count(self):
+        for msg in ['', 'a', 'abcd', 'abcde', 'abcdefghi']:
+            for blank_line in [False, True]:
+                self.assertEqual(
+                    paint.display_line_count(len(msg), 4, blank_line),
+                    len(paint.display_linize(msg, 4, blank_line)))
+
+    def test_wrap_cache_keeps_unchanged_lines(self):
+        cache = paint.WrapCache()
+        first, second = cyan('abcdef'), cyan('ghi')
+        lines = cache.wrap_lines([(1, '> ', first), (2, '. ', second)], 4)
+        self.assertEqual([line.s for line in lines], ['> ab', 'cdef', '. gh', 'i'])
+        changed = cyan('jkl')
+        again = cache.wrap_lines([(1, '> ', first), (3, '. ', changed)], 4)
+        self.assertEqual([line.s for line in again], ['> ab', 'cdef', '. jk', 'l'])
+        self.assertTrue(again[0] is lines[0] and again[1] is lines[1])
+        resized = cache.wrap_lines([(1, '> ', first), (3, '. ', changed)], 8)
+        self.assertEqual([line.s for line in resized], ['> abcdef', '. jkl'])
@@ -51,6 +51,22 @@ class TestCurtsiesRepl(unittest.TestCase):
         self.repl.send_current_block_to_external_editor()
         self.repl.send_session_to_external_editor()
 
+    def test_history_closed_on_exit(self):
+        closed = []
+        self.repl.rl_history.close = lambda: closed.append(True)
+        with self.repl:
+            pass
+        self.assertEqual(closed, [True])
+
+    def test_scrollback_spilled_to_disk(self):
+        repl = create_repl(config=setup_config({'curtsies_scrollback': 20,
+                                                 'editor': 'true'}))
+        repl.display_lines.extend(['line %d' % (i, ) for i in range(100)])
+        self.assertTrue(len(repl.display_lines.lines) <= 20 + 5)
+        self.assertEqual(repl.getstdout(),
+                         '\n'.join('line %d' % (i, ) for i in range(100)) +
+                         '\n' + repl.current_line_formatted)
+
 @contextmanager # from http://stackoverflow.com/a/17981937/398212 - thanks @rkennedy
 def captured_output():
     new_out, new_err = StringIO(), StringIO()
@@ -61,8 +77,8 @@ def captured_output():
     finally:
         sys.stdout, sys.stderr = old_out, old_err
 
-def create_repl(**kwargs):
-    config = setup_config({'editor':'true'})
+def create_repl(config=None, **kwargs):
+    config = config or setup_config({'editor':'true'})
     repl = curtsiesrepl.Repl(config=config, **kwargs)
     os.environ['PAGER'] = 'true'
     repl.width = 50
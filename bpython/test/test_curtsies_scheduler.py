@@ -0,0 +1,139 @@
+import unittest
+from mock import MagicMock, patch
+
+from curtsies.formatstringarray import fsarray
+
+from bpython import curtsies as bpcurtsies
+from bpython.curtsies import RefreshScheduler
+
+
+class TestRefreshScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RefreshScheduler(frame_rate=10)
+
+    def test_requests_are_merged(self):
+        for when in ['now', 5, 'now', 3, 4, 'now', 10]:
+            self.scheduler.request(when)
+        self.assertEqual(self.scheduler.pop_refresh(6), 'now')
+        self.assertEqual(self.scheduler.pop_refresh(6), 5)
+        self.assertEqual(self.scheduler.pop_refresh(6), None)
+        self.assertEqual(self.scheduler.timeout(6, 10), 4)
+        self.assertEqual(self.scheduler.pop_refresh(10), 10)
+        self.assertEqual(self.scheduler.timeout(10, .2), .2)
+
+    def test_paints_are_capped(self):
+        frame = fsarray(['a'])
+        self.assertTrue(self.scheduler.may_paint(100))
+        self.scheduler.painted(100, frame, (0, 0), (5, 10))
+        self.assertFalse(self.scheduler.may_paint(100.05))
+        self.assertFalse(self.scheduler.paint_due(100.05))
+        self.assertAlmostEqual(self.scheduler.timeout(100.05, .2), .05)
+        self.assertTrue(self.scheduler.paint_due(100.15))
+        self.assertTrue(self.scheduler.may_paint(100.15))
+
+    def test_identical_frames_are_not_rendered(self):
+        self.assertTrue(self.scheduler.painted(1, fsarray(['a', 'b']),
+                                               (1, 1), (5, 10)))
+        self.assertFalse(self.scheduler.painted(2, fsarray(['a', 'b']),
+                                                (1, 1), (5, 10)))
+        self.assertTrue(self.scheduler.painted(3, fsarray(['a', 'c']),
+                                               (1, 1), (5, 10)))
+        self.assertTrue(self.scheduler.painted(4, fsarray(['a', 'c']),
+                                               (1, 0), (5, 10)))
+        self.assertTrue(self.scheduler.painted(5, fsarray(['a', 'c']),
+                                               (1, 0), (5, 20)))
+
+    def test_uncapped(self):
+        scheduler = RefreshScheduler()
+        scheduler.painted(1, fsarray([]), (0, 0), (5, 10))
+        self.assertTrue(scheduler.may_paint(1))
+
+
+class FakeClock(object):
+    def __init__(self, t):
+        self.t = t
+    def time(self):
+        return self.t
+
+
+class FakeInput(object):
+    """Sends the keys it's given; None means no input until the timeout"""
+    def __init__(self, clock, keys):
+        self.clock = clock
+        self.keys = list(keys)
+        self.unget_bytes = self.original_stty = None
+    def send(self, timeout):
+        key = self.keys.pop(0)
+        if key is None:
+            self.clock.t += timeout
+        return key
+
+
+class FakeRepl(object):
+    """Shows the keys it got, requests three refreshes per key and exits
+    on 'q'"""
+    def __init__(self, request_refresh, **kwargs):
+        self.request_refresh = request_refresh
+        self.keys = ''
+        self.refresh_events = 0
+        self.scroll_offset = 0
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        pass
+    def process_event(self, e):
+        if isinstance(e, FakeRefreshRequestEvent):
+            self.refresh_events += 1
+        elif e == 'q':
+            raise SystemExit()
+        else:
+            self.keys += e
+            for _ in range(3):
+                self.request_refresh()
+    def paint(self, about_to_exit=False, user_quit=False):
+        return fsarray([self.keys + ('.' if about_to_exit else '')]), (0, 0)
+
+
+class FakeRefreshRequestEvent(object):
+    def __init__(self, when):
+        self.when = when
+
+
+class TestMainloop(unittest.TestCase):
+    def run_mainloop(self, keys, frame_rate=8):
+        clock = FakeClock(100)
+        window = MagicMock()
+        window.render_to_terminal.side_effect = lambda array, cursor_pos: (
+            self.rendered.append((clock.t, array.rows[0])) or 0)
+        self.rendered = []
+        config = MagicMock(curtsies_frame_rate=frame_rate)
+        with patch('curtsies.input.Input') as Input, \
+                patch('curtsies.window.CursorAwareWindow') as Window, \
+                patch('curtsies.events.RefreshRequestEvent',
+                      FakeRefreshRequestEvent, create=True), \
+                patch.object(bpcurtsies, 'Repl', FakeRepl), \
+                patch.object(bpcurtsies, 'time', clock), \
+                patch.object(bpcurtsies, 'find_iterator', iter([])):
+            Input.return_value.__enter__.return_value = FakeInput(clock, keys)
+            Window.return_value.__enter__.return_value = window
+            with self.assertRaises(SystemExit):
+                bpcurtsies.mainloop(config, {}, None)
+        return bpcurtsies.repl
+
+    def test_paints_are_capped(self):
+        repl = self.run_mainloop(['a', 'b', None, None, 'q'])
+        self.assertEqual([keys for t, keys in self.rendered],
+                         ['', 'ab', 'ab.'])
+        self.assertEqual(self.rendered[0][0], 100)
+        self.assertEqual(self.rendered[1][0], 100.125)
+        self.assertEqual(repl.refresh_events, 2)
+
+    def test_uncapped(self):
+        repl = self.run_mainloop(['a', 'b', None, 'q'], frame_rate=0)
+        self.assertEqual([keys for t, keys in self.rendered],
+                         ['', 'a', 'ab', 'ab.'])
+        self.assertEqual(repl.refresh_events, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
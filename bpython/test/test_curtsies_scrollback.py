@@ -0,0 +1,63 @@
+# coding: utf8
+import unittest
+
+from curtsies.fmtfuncs import red
+
+from bpython.curtsiesfrontend.scrollback import Scrollback
+from bpython.test.test_curtsies_repl import create_repl, setup_config
+
+
+class TestScrollback(unittest.TestCase):
+    def setUp(self):
+        self.lines = [u'line %d ☃' % (i, ) for i in range(100)]
+        self.scrollback = Scrollback(length=10)
+
+    def tearDown(self):
+        self.scrollback.close()
+
+    def test_older_lines_are_spilled(self):
+        for line in self.lines:
+            self.scrollback.append(line)
+        self.assertEqual(len(self.scrollback), 100)
+        self.assertTrue(self.scrollback.spilled >= 100 - 10 - 2)
+        self.assertTrue(len(self.scrollback.lines) <= 10 + 2)
+        self.assertEqual(list(self.scrollback), self.lines)
+
+    def test_indexing_like_a_list(self):
+        self.scrollback.extend(self.lines)
+        for index in [0, 5, 95, 99, -1, -10, -100]:
+            self.assertEqual(self.scrollback[index], self.lines[index])
+        for index in [slice(-5, None), slice(-50, None), slice(3, 20),
+                      slice(None, None, 2), slice(-0, None)]:
+            self.assertEqual(self.scrollback[index], self.lines[index])
+        self.assertRaises(IndexError, lambda: self.scrollback[100])
+        self.assertRaises(IndexError, lambda: self.scrollback[-101])
+
+    def test_recent_lines_keep_formatting(self):
+        lines = [red('line %d' % (i, )) for i in range(30)]
+        self.scrollback.extend(lines)
+        self.assertTrue(self.scrollback[-1] is lines[-1])
+        self.assertEqual(self.scrollback[0], 'line 0')
+        self.assertEqual(self.scrollback + ['x'],
+                         ['line %d' % (i, ) for i in range(30 - 10)] +
+                         lines[-10:] + ['x'])
+
+    def test_unbounded(self):
+        scrollback = Scrollback(self.lines)
+        self.assertEqual(scrollback.spilled, 0)
+        self.assertEqual(scrollback.lines, self.lines)
+
+    def test_output_that_is_not_utf8(self):
+        repl = create_repl(config=setup_config({'curtsies_scrollback': 4,
+                                                 'editor': 'true'}))
+        repl.send_to_stdout('\xff\xfe latin junk\n')
+        for i in range(20):
+            repl.send_to_stdout('line %d\n' % (i, ))
+        self.assertTrue(repl.display_lines.spilled > 0)
+        stdout = repl.getstdout()
+        self.assertTrue(u'latin junk' in stdout)
+        self.assertTrue(u'line 19' in stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
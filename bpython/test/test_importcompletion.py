@@ -1,17 +1,85 @@
-from bpython import importcompletion
+from __future__ import with_statement
 
+from bpython import autocomplete, importcompletion
+
+from functools import partial
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import zipfile
+
+def find_modules(path):
+    """The sorted names of the modules a full scan of `path` finds, leaving
+    the modules known to importcompletion alone."""
+    original = (importcompletion.modules, importcompletion.unexpanded_packages,
+                importcompletion.directory_prefixes)
+    importcompletion.modules = importcompletion.ModuleTrie()
+    importcompletion.unexpanded_packages = {}
+    importcompletion.directory_prefixes = {}
+    try:
+        for _ in importcompletion.find_all_modules([path]):
+            pass
+        return sorted(importcompletion.modules)
+    finally:
+        (importcompletion.modules, importcompletion.unexpanded_packages,
+         importcompletion.directory_prefixes) = original
 
 class TestSimpleComplete(unittest.TestCase):
     def setUp(self):
         self.original_modules = importcompletion.modules
-        importcompletion.modules = ['zzabc', 'zzabd', 'zzefg', 'zzabc.e', 'zzabc.f']
+        importcompletion.modules = importcompletion.ModuleTrie(
+            ['zzabc', 'zzabd', 'zzefg', 'zzabc.e', 'zzabc.f'])
     def tearDown(self):
         importcompletion.modules = self.original_modules
     def test_simple_completion(self):
         self.assertEqual(importcompletion.complete(10, 'import zza'), ['zzabc', 'zzabd'])
     def test_package_completion(self):
         self.assertEqual(importcompletion.complete(13, 'import zzabc.'), ['zzabc.e', 'zzabc.f', ])
+    def test_fuzzy_completion(self):
+        matcher = partial(autocomplete.Matcher, mode=autocomplete.FUZZY)
+        self.assertEqual(importcompletion.complete(9, 'import zb', matcher),
+                         ['zzabc', 'zzabd'])
+        self.assertEqual(importcompletion.complete(9, 'import zf', matcher),
+                         ['zzefg'])
+    def test_from_package_completion(self):
+        self.assertEqual(importcompletion.complete(19, 'from zzabc import e'), ['e'])
+
+
+class TestModuleTrie(unittest.TestCase):
+    def setUp(self):
+        self.trie = importcompletion.ModuleTrie(['a', 'a.b', 'a.b.c', 'ab', 'b'])
+
+    def test_set_operations(self):
+        self.assertEqual(len(self.trie), 5)
+        self.assertEqual(sorted(self.trie), ['a', 'a.b', 'a.b.c', 'ab', 'b'])
+        self.assertTrue('a.b' in self.trie)
+        self.assertFalse('a.c' in self.trie)
+        self.trie.add('a.b')
+        self.assertEqual(len(self.trie), 5)
+
+    def test_intermediate_names_are_not_modules(self):
+        trie = importcompletion.ModuleTrie(['x.y'])
+        self.assertFalse('x' in trie)
+        self.assertEqual(list(trie), ['x.y'])
+        self.assertEqual(trie.children_matching('', 'x'), [])
+
+    def test_children_matching(self):
+        self.assertEqual(self.trie.children_matching('', 'a'), ['a', 'ab'])
+        self.assertEqual(self.trie.children_matching('a', ''), ['a.b'])
+        self.assertEqual(self.trie.children_matching('a.b', 'c'), ['a.b.c'])
+        self.assertEqual(self.trie.children_matching('c', ''), [])
+
+    def test_discard(self):
+        self.trie.discard('a')
+        self.assertEqual(sorted(self.trie), ['ab', 'b'])
+        self.assertEqual(len(self.trie), 2)
+        self.trie.discard('x.y')
+        self.assertEqual(len(self.trie), 2)
 
 
 class TestRealComplete(unittest.TestCase):
@@ -20,8 +88,10 @@ class TestRealComplete(unittest.TestCase):
         __import__('sys')
         __import__('os')
     def tearDown(self):
-        importcompletion.find_iterator = importcompletion.find_all_modules()
-        importcompletion.modules = set()
+        importcompletion.find_iterator = importcompletion.find_all_modules(
+            lazy=True)
+        importcompletion.modules = importcompletion.ModuleTrie()
+        importcompletion.unexpanded_packages.clear()
     def test_from_attribute(self):
         self.assertEqual(importcompletion.complete(19, 'from sys import arg'), ['argv'])
     def test_from_attr_module(self):
@@ -30,3 +100,212 @@ class TestRealComplete(unittest.TestCase):
         self.assertEqual(importcompletion.complete(17, 'from xml import d'), ['dom'])
 
 
+
+
+class TestModuleIndex(unittest.TestCase):
+    def setUp(self):
+        self.original_index = importcompletion.index
+        importcompletion.index = {}
+        self.tempdir = tempfile.mkdtemp()
+        self.moddir = os.path.join(self.tempdir, 'modules')
+        os.mkdir(self.moddir)
+        open(os.path.join(self.moddir, 'zzmodule.py'), 'w').close()
+        os.mkdir(os.path.join(self.moddir, 'zzpackage'))
+        open(os.path.join(self.moddir, 'zzpackage', '__init__.py'), 'w').close()
+        open(os.path.join(self.moddir, 'zzpackage', 'sub.py'), 'w').close()
+        self.filename = os.path.join(self.tempdir, 'cache', 'modules.index')
+
+    def tearDown(self):
+        importcompletion.index = self.original_index
+        shutil.rmtree(self.tempdir)
+
+    def find(self):
+        return find_modules(self.moddir)
+
+    def test_find_modules(self):
+        self.assertEqual(self.find(), ['zzmodule', 'zzpackage', 'zzpackage.sub'])
+
+    def test_saved_index_is_used(self):
+        self.find()
+        importcompletion.save_index(self.filename, importcompletion.index)
+        importcompletion.index.clear()
+        importcompletion.load_index(self.filename)
+
+        original_scan_directory = importcompletion.scan_directory
+        def scan_directory(path):
+            self.fail('unmodified directory %r rescanned' % (path, ))
+        importcompletion.scan_directory = scan_directory
+        try:
+            self.assertEqual(self.find(),
+                             ['zzmodule', 'zzpackage', 'zzpackage.sub'])
+        finally:
+            importcompletion.scan_directory = original_scan_directory
+
+    def test_modified_directory_is_rescanned(self):
+        self.find()
+        open(os.path.join(self.moddir, 'zznew.py'), 'w').close()
+        mtime = os.stat(self.moddir).st_mtime
+        os.utime(self.moddir, (mtime + 10, mtime + 10))
+        self.assertEqual(self.find(),
+                         ['zzmodule', 'zznew', 'zzpackage', 'zzpackage.sub'])
+
+    def test_index_per_interpreter(self):
+        original = (sys.executable, importcompletion.index_filename)
+        try:
+            filenames = []
+            # Non-ASCII, undecodable bytes and (as Python 3 decodes those)
+            # lone surrogates
+            for executable in ['/usr/bin/python', u'/opt/pyth\xf6n/python',
+                               b'/opt/\xff/python', u'/opt/\udcff/python']:
+                sys.executable = executable
+                importcompletion.use_index(self.tempdir)
+                filenames.append(importcompletion.index_filename)
+        finally:
+            sys.executable, importcompletion.index_filename = original
+        self.assertEqual(len(set(filenames)), 4)
+        for filename in filenames:
+            self.assertEqual(os.path.dirname(filename), self.tempdir)
+
+    def test_bad_index_is_ignored(self):
+        os.mkdir(os.path.dirname(self.filename))
+        with open(self.filename, 'w') as f:
+            f.write('garbage')
+        importcompletion.load_index(self.filename)
+        self.assertEqual(importcompletion.index, {})
+
+
+class TestFindAllModules(unittest.TestCase):
+    def setUp(self):
+        self.original_modules = importcompletion.modules
+        self.original_unexpanded = importcompletion.unexpanded_packages
+        self.original_directory_prefixes = importcompletion.directory_prefixes
+        importcompletion.modules = importcompletion.ModuleTrie()
+        importcompletion.unexpanded_packages = {}
+        importcompletion.directory_prefixes = {}
+        self.tempdir = tempfile.mkdtemp()
+        for name in ['zzmodule.py', 'zzpackage/__init__.py', 'zzpackage/sub.py',
+                     'zzpackage/subpackage/__init__.py',
+                     'zzpackage/subpackage/deep.py', 'zznopackage/other.py']:
+            filename = os.path.join(self.tempdir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            open(filename, 'w').close()
+
+    def tearDown(self):
+        importcompletion.modules = self.original_modules
+        importcompletion.unexpanded_packages = self.original_unexpanded
+        importcompletion.directory_prefixes = self.original_directory_prefixes
+        shutil.rmtree(self.tempdir)
+
+    def test_threaded_scan(self):
+        for _ in importcompletion.find_all_modules([self.tempdir], workers=3):
+            pass
+        self.assertEqual(sorted(importcompletion.modules),
+                         ['zzmodule', 'zzpackage', 'zzpackage.sub',
+                          'zzpackage.subpackage', 'zzpackage.subpackage.deep'])
+
+    def test_exit_during_scan(self):
+        # Worker threads still running at exit used to print errors
+        root = os.path.dirname(os.path.dirname(importcompletion.__file__))
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(root))
+        code = ('from bpython import importcompletion\n'
+                'scan = importcompletion.find_all_modules([%r])\n'
+                'next(scan)\n' % (self.tempdir, ))
+        process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(stderr, b'')
+
+    def test_stuck_scan_does_not_block_exit(self):
+        stuck = threading.Event()
+        thread = threading.Thread(target=stuck.wait)
+        thread.daemon = True
+        thread.start()
+        importcompletion.scan_threads.add(thread)
+        try:
+            start = time.time()
+            importcompletion.stop_scans(timeout=.1)
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            stuck.set()
+            importcompletion.scan_threads.discard(thread)
+            importcompletion.stop_scanning.clear()
+
+    def test_lazy_scan(self):
+        for _ in importcompletion.find_all_modules([self.tempdir], lazy=True):
+            pass
+        self.assertEqual(sorted(importcompletion.modules),
+                         ['zzmodule', 'zzpackage'])
+        self.assertEqual(importcompletion.module_matches('s', 'zzpackage'),
+                         ['sub', 'subpackage'])
+        self.assertEqual(importcompletion.module_matches('zzpackage.subpackage.'),
+                         ['zzpackage.subpackage.deep'])
+        self.assertEqual(importcompletion.unexpanded_packages, {})
+
+    def test_invalidate(self):
+        for _ in importcompletion.find_all_modules([self.tempdir]):
+            pass
+        os.remove(os.path.join(self.tempdir, 'zzpackage', 'sub.py'))
+        open(os.path.join(self.tempdir, 'zzpackage', 'new.py'), 'w').close()
+        shutil.rmtree(os.path.join(self.tempdir, 'zzpackage', 'subpackage'))
+        open(os.path.join(self.tempdir, 'zznew.py'), 'w').close()
+        importcompletion.invalidate(os.path.join(self.tempdir, 'zzpackage'))
+        importcompletion.invalidate(self.tempdir)
+        self.assertEqual(importcompletion.module_matches('zz'),
+                         ['zzmodule', 'zznew', 'zzpackage'])
+        self.assertEqual(sorted(importcompletion.modules),
+                         ['zzmodule', 'zznew', 'zzpackage', 'zzpackage.new'])
+
+    def test_package_created_and_removed(self):
+        for _ in importcompletion.find_all_modules([self.tempdir]):
+            pass
+        # Reported the way a filesystem watcher sees `mkdir zznew` and
+        # `touch zznew/__init__.py`, one after the other
+        package = os.path.join(self.tempdir, 'zznew')
+        os.mkdir(package)
+        importcompletion.module_changed(package)
+        self.assertEqual(importcompletion.module_matches('zz'),
+                         ['zzmodule', 'zzpackage'])
+        init = os.path.join(package, '__init__.py')
+        open(init, 'w').close()
+        importcompletion.module_changed(init)
+        self.assertEqual(importcompletion.module_matches('zz'),
+                         ['zzmodule', 'zznew', 'zzpackage'])
+        os.remove(init)
+        importcompletion.module_changed(init)
+        self.assertEqual(importcompletion.module_matches('zz'),
+                         ['zzmodule', 'zzpackage'])
+
+
+class TestArchiveModules(unittest.TestCase):
+    def setUp(self):
+        self.original_index = importcompletion.index
+        importcompletion.index = {}
+        self.tempdir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tempdir, 'archive.egg')
+        zf = zipfile.ZipFile(self.archive, 'w')
+        for name in ['zzmodule.py', 'zzpackage/__init__.py', 'zzpackage/sub.pyc',
+                     'zznopackage/other.py', 'lib/zzinner.py', 'README.txt']:
+            zf.writestr(name, '')
+        zf.close()
+
+    def tearDown(self):
+        importcompletion.index = self.original_index
+        shutil.rmtree(self.tempdir)
+
+    def test_archive(self):
+        self.assertEqual(find_modules(self.archive),
+                         ['zzmodule', 'zzpackage', 'zzpackage.sub'])
+
+    def test_directory_inside_archive(self):
+        path = os.path.join(self.archive, 'lib')
+        self.assertEqual(find_modules(path), ['zzinner'])
+
+    def test_not_an_archive(self):
+        filename = os.path.join(self.tempdir, 'not_a_zip')
+        open(filename, 'w').close()
+        self.assertEqual(find_modules(filename), [])
+        self.assertEqual(find_modules(os.path.join(self.tempdir, 'missing')),
+                         [])
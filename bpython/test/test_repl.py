@@ -1,8 +1,16 @@
+from __future__ import with_statement
+
+import errno
 import os
+import random
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import unittest
 from itertools import islice
-from mock import Mock, MagicMock
+from mock import Mock, MagicMock, patch
 try:
     from unittest import skip
 except ImportError:
@@ -11,7 +19,10 @@ except ImportError:
 
 py3 = (sys.version_info[0] == 3)
 
+from pygments.token import Token
+
 from bpython import config, repl, cli, autocomplete
+from bpython._py3compat import PythonLexer
 
 def setup_config(conf):
     config_struct = config.Struct()
@@ -96,6 +107,36 @@ class TestHistory(unittest.TestCase):
 
         self.assertEqual(self.history.back(), 'print "foo\n"')
 
+    def test_append_removes_duplicates(self):
+        self.history.append('#500')
+        self.history.append('#1')
+        self.assertEqual(self.history.entries[-3:], ['#999', '#500', '#1'])
+        self.assertEqual(self.history.entries.count('#500'), 1)
+        self.assertEqual(self.history.entries.count('#1'), 1)
+        self.assertEqual(self.history.entry_counts['#1'], 1)
+        self.assertEqual(len(self.history.entries), 1000)
+
+    def test_searches_match_entries_by_index(self):
+        random.seed(2)
+        for _ in range(50):
+            self.history.append('#%d' % (random.randint(0, 1000), ))
+        self.history.enter('#9')
+        for include_current in [False, True]:
+            for index in [0, 1, 5, 500, 1000, 1001]:
+                self.history.index = index
+                by_index = self.history.entries_by_index
+                start = index + (0 if include_current else 1)
+                backward = [i - index for i in range(start, len(by_index))
+                            if '#9' in by_index[i]]
+                self.assertEqual(self.history.find_partial_match_backward(
+                    '#9', include_current), (backward or [0])[0])
+                end = max(0, index - (1 if include_current else 0))
+                forward = [end - i - (1 if include_current else 0)
+                           for i in range(end - 1, -1, -1)
+                           if by_index[i].startswith('#9')]
+                self.assertEqual(self.history.find_match_forward(
+                    '#9', include_current), (forward or [index])[0])
+
     @skip("I don't understand this test")
     def test_enter(self):
         self.history.enter('#lastnumber!')
@@ -110,6 +151,269 @@ class TestHistory(unittest.TestCase):
         self.assertEqual(self.history.back(), '#999')
         self.assertEqual(self.history.forward(), '')
 
+class TestPrefixIndex(unittest.TestCase):
+    def test_latest(self):
+        index = repl.PrefixIndex(['import os', 'import sys', 'imp', 'x = 1'])
+        self.assertEqual(index.latest('import'), 'import sys')
+        self.assertEqual(index.latest('import o'), 'import os')
+        self.assertEqual(index.latest('im'), 'imp')
+        self.assertEqual(index.latest(''), 'x = 1')
+        self.assertEqual(index.latest('import x'), None)
+        self.assertEqual(index.latest('imports'), None)
+        index.add('import os.path')
+        self.assertEqual(index.latest('i'), 'import os.path')
+        self.assertEqual(index.latest('import s'), 'import sys')
+
+    def test_history_suggestions(self):
+        history = repl.History(duplicates=False)
+        for line in ['a = 1', 'ab = 2', 'b = 1', 'a = 1']:
+            history.append(line)
+        self.assertEqual(history.last_entry_starting_with('a'), 'a = 1')
+        self.assertEqual(history.last_entry_starting_with('ab'), 'ab = 2')
+        history.append('ab = 3')
+        self.assertEqual(history.last_entry_starting_with('a'), 'ab = 3')
+        history.entries.pop()
+        self.assertEqual(history.last_entry_starting_with('a'), 'a = 1')
+        history.entries = ['x']
+        self.assertEqual(history.last_entry_starting_with('a'), None)
+
+    def test_matches_scanning_the_history(self):
+        random.seed(1)
+        for duplicates in [False, True]:
+            history = repl.History(duplicates=duplicates)
+            for _ in range(300):
+                history.append(''.join(random.choice('ab') for _ in range(4)))
+                prefix = ''.join(random.choice('ab')
+                                 for _ in range(random.randint(1, 4)))
+                expected = [entry for entry in history.entries
+                            if entry.startswith(prefix)]
+                self.assertEqual(history.last_entry_starting_with(prefix),
+                                 expected[-1] if expected else None)
+
+    def test_built_index_matches_scanning(self):
+        random.seed(2)
+        entries = [''.join(random.choice('abc') for _ in range(5))
+                   for _ in range(200)]
+        index = repl.PrefixIndex(entries)
+        for _ in range(300):
+            if random.random() < 0.3:
+                entries.append(''.join(random.choice('abc')
+                                       for _ in range(random.randint(1, 6))))
+                index.add(entries[-1])
+            prefix = ''.join(random.choice('abc')
+                             for _ in range(random.randint(0, 5)))
+            expected = [entry for entry in entries if entry.startswith(prefix)]
+            self.assertEqual(index.latest(prefix),
+                             expected[-1] if expected else None)
+
+    def test_extend_builds_index(self):
+        history = repl.History([])
+        history.extend(['a = 1', 'ab = 2'])
+        self.assertTrue(history.is_indexed())
+        history.extend(['b = 1'])
+        self.assertEqual(history.last_entry_starting_with('a'), 'ab = 2')
+        self.assertEqual(history.last_entry_starting_with('b'), 'b = 1')
+
+
+class TestTrigramIndex(unittest.TestCase):
+    def test_candidates(self):
+        index = repl.TrigramIndex()
+        for seq, entry in enumerate(['import os', 'x = 1', 'import sys',
+                                     'os.path']):
+            index.add(entry, seq)
+        self.assertEqual(list(index.candidates('mport', 4)), [2, 0])
+        self.assertEqual(list(index.candidates('os.', 3)), [])
+        self.assertEqual(list(index.candidates('mport', 0, backward=False)),
+                         [2])
+        self.assertEqual(list(index.candidates('xyz', 4)), [])
+
+    def test_search_like_scanning_the_history(self):
+        random.seed(3)
+        for duplicates in [False, True]:
+            history = repl.History(duplicates=duplicates)
+            # Index in small chunks, to search partly indexed entries
+            history.trigram_chunk = 16
+            for i in range(1500):
+                history.append(''.join(random.choice('ab') for _ in range(5)))
+                if i % 50 == 49:
+                    history.truncate_entries(len(history.entries) - 10)
+                if i % 100 == 0:
+                    history.find_partial_match_backward('bab')
+            history.enter('aab')
+            for term in ['aab', 'abab', 'bbbbb', 'ba']:
+                indexes = list(range(len(history.entries) + 1))
+                random.shuffle(indexes)
+                for index in indexes:
+                    history.index = index
+                    matches = lambda entry: term in entry
+                    for include_current in [False, True]:
+                        self.assertEqual(
+                            history.find_partial_match_backward(
+                                term, include_current),
+                            history.search_backward(matches, include_current))
+                    if index > 1:
+                        self.assertEqual(
+                            history.find_partial_match_forward(term),
+                            history.search_forward(matches, False))
+
+    def test_search_does_not_match_across_entries(self):
+        history = repl.History(['ab', 'c\nd', 'e', 'a\nb'])
+        history.enter('')
+        self.assertEqual(history.back(False, search=True, target='b\nc'), '')
+        self.assertEqual(history.back(False, search=True, target='d\ne'), '')
+        self.assertEqual(history.back(False, search=True, target='c\nd'),
+                         'c\nd')
+        history.index = 4
+        self.assertEqual(history.forward(False, search=True, target='a\nb'),
+                         'a\nb')
+
+class TestHistoryFile(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'history')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read_lines(self):
+        with open(self.filename) as f:
+            return f.read().splitlines()
+
+    def test_save_and_load(self):
+        history = repl.History(['#1', '#2', '#3'])
+        history.save(self.filename, 'utf-8', 2)
+        self.assertEqual(self.read_lines(), ['#2', '#3'])
+        history = repl.History([])
+        history.load(self.filename, 'utf-8')
+        self.assertEqual(history.entries, ['#2', '#3'])
+
+    def test_save_through_symlink(self):
+        os.mkdir(os.path.join(self.tempdir, 'dotfiles'))
+        target = os.path.join(self.tempdir, 'dotfiles', 'history')
+        with open(target, 'w') as f:
+            f.write('#1\n')
+        os.chmod(target, 0640)
+        os.symlink(target, self.filename)
+        repl.History(['#2', '#3']).save(self.filename, 'utf-8')
+        self.assertTrue(os.path.islink(self.filename))
+        self.assertEqual(self.read_lines(), ['#2', '#3'])
+        self.assertEqual(os.stat(target).st_mode & 0777, 0640)
+        self.assertEqual(os.listdir(os.path.dirname(target)), ['history'])
+
+    def test_save_without_temporary_file(self):
+        with open(self.filename, 'w') as f:
+            f.write('#1\n')
+        mkstemp = Mock(side_effect=OSError(errno.EACCES, 'Permission denied'))
+        with patch('tempfile.mkstemp', mkstemp):
+            repl.History(['#2', '#3']).save(self.filename, 'utf-8')
+        self.assertTrue(mkstemp.called)
+        self.assertEqual(self.read_lines(), ['#2', '#3'])
+
+    def test_load_like_appending(self):
+        random.seed(4)
+        lines = ['#%d' % (random.randint(0, 50), ) for _ in range(200)]
+        with open(self.filename, 'w') as f:
+            f.write('\n'.join(lines + ['', '#incomplete']))
+        for duplicates in [False, True]:
+            expected = repl.History(['#1', '#70'], duplicates=duplicates)
+            for line in lines:
+                expected.append(line)
+            history = repl.History(['#1', '#70'], duplicates=duplicates)
+            history.load(self.filename, 'utf-8')
+            self.assertEqual(history.entries, expected.entries)
+            self.assertEqual(history.entry_counts, expected.entry_counts)
+            self.assertEqual(history.file_lines, len(lines) + 1)
+
+    def test_reloading_duplicates_keeps_indexes(self):
+        for lines in [['#3'], ['#%d' % (i, ) for i in range(0, 300, 2)]]:
+            history = repl.History([])
+            history.extend('#%d' % (i, ) for i in range(200))
+            history.find_partial_match_backward('#19')
+            prefix_index = history.prefix_index
+            trigram_indexes = history.trigram_indexes
+            expected = repl.History(history.entries)
+            for line in lines:
+                expected.append(line)
+            history.extend(lines)
+            self.assertEqual(history.entries, expected.entries)
+            self.assertEqual(history.entry_counts, expected.entry_counts)
+            self.assertTrue(history.prefix_index is prefix_index)
+            self.assertTrue(history.trigram_indexes is trigram_indexes)
+            latest = '#198' if len(lines) > 1 else '#199'
+            self.assertEqual(history.last_entry_starting_with('#1'), latest)
+            history.enter('')
+            self.assertEqual(history.back(False, search=True, target='#19'),
+                             latest)
+
+    def test_lines_are_appended(self):
+        history = repl.History([])
+        history.append_reload_and_write('#1', self.filename, 'utf-8', 10)
+        history.append_reload_and_write('#2\n', self.filename, 'utf-8', 10)
+        self.assertEqual(self.read_lines(), ['#1', '#2'])
+        self.assertEqual(history.entries, ['#1', '#2'])
+
+    def test_line_appended_in_memory_is_not_repeated(self):
+        history = repl.History([], duplicates=True)
+        history.append_reload_and_write('#1', self.filename, 'utf-8', 10)
+        history.append('#2')
+        history.append_reload_and_write('#2', self.filename, 'utf-8', 10)
+        self.assertEqual(history.entries, ['#1', '#2'])
+
+    def test_sessions_are_merged(self):
+        first = repl.History([])
+        second = repl.History([])
+        first.append_reload_and_write('#1', self.filename, 'utf-8', 10)
+        second.load(self.filename, 'utf-8')
+        first.append_reload_and_write('#2', self.filename, 'utf-8', 10)
+        second.append_reload_and_write('#3', self.filename, 'utf-8', 10)
+        first.append_reload_and_write('#4', self.filename, 'utf-8', 10)
+        self.assertEqual(first.entries, ['#1', '#2', '#3', '#4'])
+        self.assertEqual(second.entries, ['#1', '#2', '#3'])
+        self.assertEqual(self.read_lines(), ['#1', '#2', '#3', '#4'])
+
+    def test_compaction(self):
+        history = repl.History([])
+        for i in range(7):
+            history.append_reload_and_write('#%d' % (i, ), self.filename,
+                                            'utf-8', 3)
+        # compacted to 3 lines after the 7th
+        self.assertEqual(self.read_lines(), ['#4', '#5', '#6'])
+        other = repl.History([])
+        other.append_reload_and_write('#7', self.filename, 'utf-8', 3)
+        self.assertEqual(other.entries, ['#4', '#5', '#6', '#7'])
+
+    def test_replaced_file_is_reloaded(self):
+        first = repl.History([])
+        second = repl.History([])
+        for i in range(2):
+            first.append_reload_and_write('#%d' % (i, ), self.filename,
+                                          'utf-8', 1)
+        second.load(self.filename, 'utf-8')
+        self.assertEqual(second.entries, ['#0', '#1'])
+        first.append_reload_and_write('#2', self.filename, 'utf-8', 1)
+        self.assertEqual(self.read_lines(), ['#2'])
+        second.append_reload_and_write('#3', self.filename, 'utf-8', 1)
+        self.assertEqual(second.entries, ['#2', '#3'])
+
+    def test_appending_waits_for_compaction(self):
+        if repl.fcntl is None:
+            return
+        first = repl.History([])
+        first.append_reload_and_write('#1', self.filename, 'utf-8')
+        second = repl.History([])
+        second.load(self.filename, 'utf-8')
+        writer = threading.Thread(target=second.append_reload_and_write,
+                                  args=('#2', self.filename, 'utf-8'))
+        with repl.locked_history_file(self.filename):
+            writer.start()
+            time.sleep(0.1)
+            self.assertTrue(writer.is_alive())
+            # Replaces the file while the other session waits for it
+            first.save(self.filename, 'utf-8')
+        writer.join()
+        self.assertEqual(self.read_lines(), ['#1', '#2'])
+        self.assertEqual(second.entries, ['#1', '#2'])
+
 class TestMatchesIterator(unittest.TestCase):
 
     def setUp(self):
@@ -187,6 +491,72 @@ class TestMatchesIterator(unittest.TestCase):
         self.assertTrue(self.matches_iterator.is_cseq())
 
 
+class TestLineLexer(unittest.TestCase):
+    def setUp(self):
+        self.lexer = repl.LineLexer()
+
+    def test_tokens_like_python_lexer(self):
+        for source in [u'def f(x):\n    return x + 1',
+                       u'x = """abc\n  def\n""" + 1',
+                       u'a = (1,\n     2)\n\n',
+                       u"x = 'abc",
+                       u'print "a" # c\n\nfoo',
+                       u'']:
+            self.assertEqual(self.lexer.get_tokens(source),
+                             list(PythonLexer().get_tokens(source)))
+
+    def test_unchanged_lines_are_not_lexed_again(self):
+        self.lexer.get_tokens(u'x = """\nabc')
+        first = self.lexer.lines[0]
+        tokens = self.lexer.get_tokens(u'x = """\nab"""')
+        self.assertTrue(self.lexer.lines[0] is first)
+        self.assertTrue((Token.Literal.String.Double, u'ab') in tokens)
+        # The next line starts in another state when one before it changes
+        tokens = self.lexer.get_tokens(u'x = 1\nab"""')
+        self.assertTrue((Token.Name, u'ab') in tokens)
+
+
+class TestBracketIndex(unittest.TestCase):
+    def setUp(self):
+        self.repl = FakeRepl()
+        self.repl.cpos = 0
+        self.reprinted = []
+        self.repl.reprint_line = lambda lineno, tokens: self.reprinted.append(
+            (lineno, tokens))
+
+    def test_open_brackets(self):
+        lexer = repl.LineLexer()
+        index = repl.BracketIndex()
+        lexed = lexer.lex(u'd = {1: (2,\n     3),\n     4: [')
+        stack, search = index.update(lexed)
+        self.assertEqual([(lineno, value) for lineno, _, _, value in stack],
+                         [(0, u'{'), (2, u'[')])
+        self.assertTrue(search)
+        first = index.lines[0]
+        index.update(lexer.lex(u'd = {1: (2,\n     3),\n     4: ]'))
+        self.assertTrue(index.lines[0] is first)
+        # A wrong closing bracket is ignored
+        stack, search = index.update(lexer.lex(u'd = {1: (2,\n     3)]'))
+        self.assertEqual([value for _, _, _, value in stack], [u'{'])
+        stack, search = index.update(lexer.lex(u'd = {1: (2,\n     3)}}'))
+        self.assertEqual(stack, ())
+        self.assertFalse(search)
+
+    def test_matching_bracket_on_earlier_line(self):
+        self.repl.buffer = [u'd = {1: (2,', u'     3),']
+        tokens = self.repl.tokenize(u'     4: 5}')
+        self.assertEqual(tokens[-1], (repl.Parenthesis, u'}'))
+        self.assertEqual(len(self.reprinted), 1)
+        lineno, line_tokens = self.reprinted[0]
+        self.assertEqual(lineno, 0)
+        self.assertTrue((repl.Parenthesis, u'{') in line_tokens)
+        # The remembered tokens of the line are not highlighted
+        self.assertFalse((repl.Parenthesis, u'{') in
+                         self.repl.bracket_index.lines[0][1])
+        self.assertEqual(self.repl.highlighted_paren,
+                         (0, self.repl.bracket_index.lines[0][1]))
+
+
 class TestArgspec(unittest.TestCase):
     def setUp(self):
         self.repl = FakeRepl()
@@ -287,25 +657,23 @@ class TestRepl(unittest.TestCase):
         self.assertEqual(self.repl.matches_iter.matches,
             ['def', 'del', 'delattr(', 'dict(', 'dir(', 'divmod('])
 
-    @skip("disabled while non-simple completion is disabled")
     def test_substring_global_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.SUBSTRING})
         self.setInputLine("time")
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
             ['RuntimeError(', 'RuntimeWarning('])
 
-    @skip("disabled while non-simple completion is disabled")
     def test_fuzzy_global_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.FUZZY})
         self.setInputLine("doc")
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
-            ['UnboundLocalError(', '__doc__'])
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
+            ['__doc__', 'UnboundLocalError('])
 
     # 2. Attribute tests
     def test_simple_attribute_complete(self):
@@ -321,7 +689,6 @@ class TestRepl(unittest.TestCase):
         self.assertEqual(self.repl.matches_iter.matches,
             ['Foo.bar'])
 
-    @skip("disabled while non-simple completion is disabled")
     def test_substring_attribute_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.SUBSTRING})
         self.setInputLine("Foo.az")
@@ -331,11 +698,10 @@ class TestRepl(unittest.TestCase):
             self.repl.push(line)
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
             ['Foo.baz'])
 
-    @skip("disabled while non-simple completion is disabled")
     def test_fuzzy_attribute_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.FUZZY})
         self.setInputLine("Foo.br")
@@ -345,8 +711,8 @@ class TestRepl(unittest.TestCase):
             self.repl.push(line)
 
         self.assertTrue(self.repl.complete())
-        self.assertTrue(hasattr(self.repl.completer,'matches'))
-        self.assertEqual(self.repl.completer.matches,
+        self.assertTrue(hasattr(self.repl.matches_iter,'matches'))
+        self.assertEqual(self.repl.matches_iter.matches,
             ['Foo.bar'])
 
     # 3. Edge Cases
@@ -360,6 +726,42 @@ class TestRepl(unittest.TestCase):
         self.assertEqual(self.repl.matches_iter.matches,
             ['foobar'])
 
+    # 4. Narrowing while typing
+    def test_narrowing_does_not_look_up_names(self):
+        self.repl = FakeRepl({'autocomplete_mode': autocomplete.SIMPLE})
+        self.repl.push("foobar = 2")
+        self.repl.push("foobaz = 3")
+        self.setInputLine("foo")
+        self.assertTrue(self.repl.complete())
+        self.assertEqual(self.repl.matches_iter.matches, ['foobar', 'foobaz'])
+
+        self.repl.interp.locals['foobarbaz'] = 4
+        self.setInputLine("fooba")
+        self.assertTrue(self.repl.complete())
+        self.assertEqual(self.repl.matches_iter.current_word, 'fooba')
+        self.assertEqual(self.repl.matches_iter.matches, ['foobar', 'foobaz'])
+
+    def test_narrowing_after_running_code(self):
+        self.repl = FakeRepl({'autocomplete_mode': autocomplete.SIMPLE})
+        self.repl.push("foobar = 2")
+        self.repl.push("foobaz = 3")
+        self.setInputLine("foo")
+        self.repl.complete()
+        self.repl.push("foobarbaz = 4")
+        self.setInputLine("foobar")
+        self.repl.complete()
+        self.assertEqual(self.repl.matches_iter.matches,
+                         ['foobar', 'foobarbaz'])
+
+    def test_no_narrowing_across_dots(self):
+        self.repl = FakeRepl({'autocomplete_mode': autocomplete.SIMPLE})
+        self.repl.push("import os")
+        self.setInputLine("os")
+        self.repl.complete()
+        self.setInputLine("os.pat")
+        self.assertTrue(self.repl.complete())
+        self.assertTrue('os.path' in self.repl.matches_iter.matches)
+
     def test_file_should_not_appear_in_complete(self):
         self.repl = FakeRepl({'autocomplete_mode': autocomplete.SIMPLE})
         self.setInputLine("_")
@@ -393,11 +795,25 @@ class TestCliRepl(unittest.TestCase):
         self.repl.addstr('buzz')
         self.assertEqual(self.repl.s, "foobuzzbar")
 
+class Foo:
+    foobar = 1
+
+
 class TestCliReplTab(unittest.TestCase):
 
     def setUp(self):
         self.repl = FakeCliRepl()
 
+    def setup_completion(self, mode, **locals_):
+        """Complete for real, names from a namespace with foobar and Foo"""
+        repl.Repl.__init__(self.repl, repl.Interpreter(),
+                           setup_config({'autocomplete_mode': mode}))
+        self.repl.interp.locals.update(foobar=1, Foo=Foo, **locals_)
+        self.repl.paste_mode = False
+        self.repl.scr = Mock()
+        self.repl.print_line = Mock()
+        self.repl.show_list = Mock()
+
     # 3 Types of tab complete
     def test_simple_tab_complete(self):
         self.repl.matches_iter = MagicMock()
@@ -418,19 +834,17 @@ class TestCliReplTab(unittest.TestCase):
         self.repl.complete.assert_called_with(tab=True)
         self.assertEqual(self.repl.s, "foobar")
 
-    @skip("disabled while non-simple completion is disabled")
     def test_substring_tab_complete(self):
-        self.repl.s = "bar"
-        self.repl.config.autocomplete_mode = autocomplete.FUZZY
+        self.setup_completion(autocomplete.SUBSTRING)
+        self.repl.s = "obar"
         self.repl.tab()
         self.assertEqual(self.repl.s, "foobar")
         self.repl.tab()
-        self.assertEqual(self.repl.s, "foofoobar")
+        self.assertEqual(self.repl.s, "foobar")
 
-    @skip("disabled while non-simple completion is disabled")
     def test_fuzzy_tab_complete(self):
-        self.repl.s = "br"
-        self.repl.config.autocomplete_mode = autocomplete.FUZZY
+        self.setup_completion(autocomplete.FUZZY)
+        self.repl.s = "fobr"
         self.repl.tab()
         self.assertEqual(self.repl.s, "foobar")
 
@@ -462,20 +876,18 @@ class TestCliReplTab(unittest.TestCase):
         self.assertTrue(self.repl.s, "previtem")
 
     # Attribute Tests
-    @skip("disabled while non-simple completion is disabled")
     def test_fuzzy_attribute_tab_complete(self):
         """Test fuzzy attribute with no text"""
+        self.setup_completion(autocomplete.FUZZY)
         self.repl.s = "Foo."
-        self.repl.config.autocomplete_mode = autocomplete.FUZZY
 
         self.repl.tab()
         self.assertEqual(self.repl.s, "Foo.foobar")
 
-    @skip("disabled while non-simple completion is disabled")
     def test_fuzzy_attribute_tab_complete2(self):
         """Test fuzzy attribute with some text"""
+        self.setup_completion(autocomplete.FUZZY)
         self.repl.s = "Foo.br"
-        self.repl.config.autocomplete_mode = autocomplete.FUZZY
 
         self.repl.tab()
         self.assertEqual(self.repl.s, "Foo.foobar")
@@ -491,14 +903,12 @@ class TestCliReplTab(unittest.TestCase):
         self.repl.tab()
         self.assertEqual(self.repl.s, "foo")
 
-    @skip("disabled while non-simple completion is disabled")
     def test_substring_expand_forward(self):
-        self.repl.config.autocomplete_mode = autocomplete.SUBSTRING
-        self.repl.s = "ba"
+        self.setup_completion(autocomplete.SUBSTRING, foobaz=2)
+        self.repl.s = "foo"
         self.repl.tab()
-        self.assertEqual(self.repl.s, "bar")
+        self.assertEqual(self.repl.s, "fooba")
 
-    @skip("disabled while non-simple completion is disabled")
     def test_fuzzy_expand(self):
         pass
 
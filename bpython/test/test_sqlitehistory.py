@@ -0,0 +1,215 @@
+from __future__ import with_statement
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from mock import Mock
+
+try:
+    import sqlite3
+    from bpython.sqlitehistory import SQLiteHistory
+    has_sqlite = True
+except ImportError:
+    has_sqlite = False
+
+from bpython import config, repl
+
+try:
+    from unittest import skipUnless
+except ImportError:
+    def skipUnless(condition, reason):
+        if condition:
+            return lambda x: x
+        else:
+            return lambda x: None
+
+
+@skipUnless(has_sqlite, "sqlite3 required")
+class TestSQLiteHistory(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'history.sqlite')
+        self.history = SQLiteHistory(self.filename)
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.tempdir)
+
+    def write(self, history, *lines):
+        for line in lines:
+            history.append_reload_and_write(line, None, 'utf-8')
+
+    def test_lines_are_stored(self):
+        self.write(self.history, 'a = 1', 'b = 2', 'a = 1')
+        self.assertEqual(self.history.entries, ['', 'b = 2', 'a = 1'])
+        other = SQLiteHistory(self.filename, duplicates=True)
+        self.assertEqual(other.entries, ['', 'a = 1', 'b = 2', 'a = 1'])
+        other.close()
+
+    def test_sessions_are_merged(self):
+        other = SQLiteHistory(self.filename)
+        self.write(self.history, '#1')
+        self.write(other, '#2')
+        self.write(self.history, '#3')
+        self.assertEqual(self.history.entries, ['', '#1', '#2', '#3'])
+        self.assertEqual(other.entries, ['', '#1', '#2'])
+        other.close()
+
+    def test_metadata(self):
+        self.write(self.history, '1/0')
+        try:
+            1/0
+        except ZeroDivisionError:
+            sys.last_traceback = sys.exc_info()[2]
+        self.write(self.history, 'pass')
+        self.history.update_status()
+        rows = self.history.connection.execute(
+            'SELECT line, session, cwd, status, time FROM history ORDER BY id'
+            ).fetchall()
+        self.assertEqual([(line, status) for line, _, _, status, _ in rows],
+                         [('1/0', 1), ('pass', 0)])
+        for _, session, cwd, _, time in rows:
+            self.assertEqual(session, self.history.session)
+            self.assertEqual(cwd, os.getcwd())
+            self.assertTrue(time > 0)
+
+    def test_status_written_on_close(self):
+        history = SQLiteHistory(self.filename)
+        self.write(history, '1/0')
+        try:
+            1/0
+        except ZeroDivisionError:
+            sys.last_traceback = sys.exc_info()[2]
+        history.close()
+        self.assertEqual(self.history.connection.execute(
+            'SELECT status FROM history').fetchall(), [(1, )])
+
+    def test_reload_like_appending(self):
+        random.seed(1)
+        lines = ['#%d' % (random.randint(0, 150), ) for _ in range(500)]
+        for duplicates in [False, True]:
+            filename = os.path.join(self.tempdir, '%s.sqlite' % (duplicates, ))
+            writer = SQLiteHistory(filename, duplicates=duplicates)
+            reader = SQLiteHistory(filename, duplicates=duplicates)
+            self.write(writer, *lines[:250])
+            reader.reload()
+            # More lines already in the history than are removed one by one
+            self.write(writer, *lines[250:])
+            reader.reload()
+            expected = repl.History(duplicates=duplicates)
+            for line in lines:
+                expected.append(line)
+            self.assertEqual(reader.entries, expected.entries)
+            rows = dict(reader.connection.execute(
+                'SELECT id, line FROM history'))
+            self.assertEqual([rows[row_id] for row_id in reader.ids[1:]],
+                             reader.entries[1:])
+            self.assertEqual(reader.ids, sorted(reader.ids))
+            writer.close()
+            reader.close()
+
+    def test_import_history_file(self):
+        filename = os.path.join(self.tempdir, 'history')
+        with open(filename, 'w') as f:
+            f.write('#1\n#2\n')
+        self.history.load(filename, 'utf-8')
+        self.assertEqual(self.history.entries, ['', '#1', '#2'])
+
+    def test_last_entry_starting_with(self):
+        self.write(self.history, 'import os', 'import sys', 'x = 1')
+        self.assertEqual(self.history.last_entry_starting_with('imp'),
+                         'import sys')
+        self.assertEqual(self.history.last_entry_starting_with('y'), None)
+
+    def test_astral_characters_after_prefix(self):
+        self.write(self.history, u'"\U0001f600"', u'"\uffff"',
+                   u'"\U0001f600\U0001f600"', u'x = 1')
+        self.assertEqual(self.history.last_entry_starting_with(u'"'),
+                         u'"\U0001f600\U0001f600"')
+        self.assertEqual(self.history.last_entry_starting_with(u'"\U0001f600'),
+                         u'"\U0001f600\U0001f600"')
+        self.assertEqual(self.history.last_entry_starting_with(u'"\uffff'),
+                         u'"\uffff"')
+        self.assertEqual(self.history.last_entry_starting_with(u''), u'x = 1')
+
+    def test_search_like_list_history(self):
+        random.seed(0)
+        words = ['foo', 'bar', 'baz', 'fo', 'oba', '"']
+        lines = [' '.join(random.sample(words, 2)) for _ in range(60)]
+        for duplicates in [False, True]:
+            history = SQLiteHistory(os.path.join(self.tempdir,
+                                                 '%s.sqlite' % (duplicates, )),
+                                    duplicates=duplicates)
+            self.write(history, *lines)
+            expected = repl.History(duplicates=duplicates)
+            for line in lines:
+                expected.append(line)
+            self.assertEqual(history.entries, expected.entries)
+            for term in ['fo', 'foo', 'o ba', 'bar f', '"', 'xyz']:
+                for start in [True, False]:
+                    for h in [history, expected]:
+                        h.reset()
+                    for _ in range(len(lines)):
+                        self.assertEqual(
+                            history.back(start, search=not start, target=term),
+                            expected.back(start, search=not start,
+                                          target=term))
+                    for _ in range(len(lines)):
+                        self.assertEqual(
+                            history.forward(start, search=not start,
+                                            target=term),
+                            expected.forward(start, search=not start,
+                                             target=term))
+                for h in [history, expected]:
+                    h.reset()
+                    h.enter('fo')
+                for _ in range(len(lines)):
+                    self.assertEqual(
+                        history.back(False, search=True, target=term,
+                                     include_current=True),
+                        expected.back(False, search=True, target=term,
+                                      include_current=True))
+            history.close()
+
+
+
+@skipUnless(has_sqlite, "sqlite3 required")
+class TestReplWithDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.config = config.Struct()
+        config.loadini(self.config, os.devnull)
+        self.config.hist_file = os.devnull
+        self.config.hist_db = os.path.join(self.tempdir, 'history.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_locked_database(self):
+        r = repl.Repl(repl.Interpreter(), self.config)
+        r.interact.notify = Mock()
+        r.rl_history.append_reload_and_write = Mock(
+            side_effect=sqlite3.OperationalError('database is locked'))
+        r.insert_into_history('x = 1')
+        self.assertEqual(r.rl_history.entries[-1], 'x = 1')
+        self.assertTrue(r.interact.notify.called)
+        r.rl_history.close()
+
+    def test_missing_directory(self):
+        self.config.hist_db = os.path.join(self.tempdir, 'missing',
+                                           'history.sqlite')
+        r = repl.Repl(repl.Interpreter(), self.config)
+        self.assertEqual(type(r.rl_history), repl.History)
+
+    def test_not_a_database(self):
+        with open(self.config.hist_db, 'w') as f:
+            f.write('#1\n' * 100)
+        r = repl.Repl(repl.Interpreter(), self.config)
+        self.assertEqual(type(r.rl_history), repl.History)
+
+
+if __name__ == '__main__':
+    unittest.main()
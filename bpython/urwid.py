@@ -45,7 +45,8 @@ from optparse import Option
 
 from pygments.token import Token
 
-from bpython import args as bpargs, repl, translations
+from bpython import args as bpargs, importcompletion, repl, translations
+from bpython.config import get_cache_home
 from bpython._py3compat import py3
 from bpython.formatter import theme_map
 from bpython.importcompletion import find_coroutine
@@ -1137,6 +1138,8 @@ def main(args=None, locals_=None, banner=None):
                 'twisted for reactor support.\n')
         return
 
+    importcompletion.use_index(get_cache_home())
+
     palette = [
         (name, COLORMAP[color.lower()], 'default',
          'bold' if color.isupper() else 'default')
@@ -1302,6 +1305,7 @@ def main(args=None, locals_=None, banner=None):
         run_find_coroutine()
 
     myrepl.main_loop.screen.run_wrapper(run_with_screen_before_mainloop)
+    myrepl.rl_history.close()
 
     if config.flush_output and not options.quiet:
         sys.stdout.write(myrepl.getstdout())